@@ -0,0 +1,219 @@
+import logging
+import os
+import sqlite3
+import tempfile
+from itertools import islice
+
+import p4_utils
+import pipeline
+from pipeline import SharedData
+from roster import Roster
+
+# Create a custom logger
+logger = logging.getLogger("main.chunked")
+
+# Roster rows read, planned and applied at a time.
+CHUNK_SIZE = 5000
+
+
+class MembershipSpill:
+    """Group memberships from every slice, kept in a temporary sqlite file.
+
+    Lets the group specs be written once per group at the end of a run
+    without holding every membership of a very large roster in memory.
+    """
+
+    def __init__(self, directory=None):
+        handle, self.path = tempfile.mkstemp(suffix=".sqlite", dir=directory)
+        os.close(handle)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE members (grp TEXT, user TEXT, owner INTEGER, "
+            "PRIMARY KEY (grp, user))"
+        )
+        self.db.execute("CREATE TABLE groups (grp TEXT PRIMARY KEY)")
+
+    def add(self, group_members):
+        """Store a slice's memberships and return the groups not seen before."""
+        rows = [
+            (group, user, user in members["Owners"])
+            for group, members in group_members.items()
+            for user in members["Users"]
+        ]
+        self.db.executemany(
+            "INSERT INTO members VALUES (?, ?, ?) ON CONFLICT (grp, user) "
+            "DO UPDATE SET owner = max(owner, excluded.owner)",
+            rows,
+        )
+        new_groups = [
+            group
+            for group in group_members
+            if self.db.execute(
+                "INSERT OR IGNORE INTO groups VALUES (?)", (group,)
+            ).rowcount
+        ]
+        self.db.commit()
+        return new_groups
+
+    def group_chunks(self, size):
+        """Every group name, in lists of at most size names."""
+        cursor = self.db.execute("SELECT grp FROM groups ORDER BY grp")
+        while True:
+            groups = [row[0] for row in cursor.fetchmany(size)]
+            if not groups:
+                return
+            yield groups
+
+    def members(self, groups) -> dict:
+        """{group: {"Users": [...], "Owners": [...]}} for the given groups."""
+        group_members = {group: {"Users": [], "Owners": []} for group in groups}
+        placeholders = ",".join("?" * len(groups))
+        for group, user, owner in self.db.execute(
+            f"SELECT grp, user, owner FROM members WHERE grp IN ({placeholders}) "
+            "ORDER BY grp, rowid",
+            groups,
+        ):
+            if owner:
+                group_members[group]["Owners"].append(user)
+            group_members[group]["Users"].append(user)
+        return group_members
+
+    def close(self):
+        self.db.close()
+        os.remove(self.path)
+
+
+def slices(rows, size):
+    """Consecutive lists of at most size items from an iterable."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_chunked(base_data, rows, undo_file, chunk_size=CHUNK_SIZE):
+    """Apply a roster of any size in slices of chunk_size rows.
+
+    rows: an iterable of validated CSV rows, read lazily.
+    Each slice's users, depots and streams are created (and depots
+    populated) as the slice is read. Memberships are spilled to disk and
+    every group is written once at the end, followed by a single
+    protections write for all of the roster's groups. Undo commands are
+    appended to undo_file as they are produced. Returns the merged
+    verification report.
+    """
+    existing_depots = p4_utils.collect_field("name", "depots")
+    existing_groups = p4_utils.get_existing_group_names()
+    spill = MembershipSpill(directory=os.path.dirname(os.path.abspath(undo_file)))
+    # One parsed template shared by every slice.
+    stream_template = None
+
+    def new_slice_data(roster=None):
+        shared_data = SharedData()
+        shared_data.default_password = base_data.default_password
+        shared_data.require_password_reset = base_data.require_password_reset
+        shared_data.template_depot = base_data.template_depot
+        shared_data.stream_template = stream_template
+        if roster is not None:
+            shared_data.roster = roster
+        return shared_data
+
+    def write_undo(shared_data):
+        # Append the slice's new undo commands, then forget them.
+        with open(undo_file, "a") as f:
+            f.writelines(f"{command}\n" for command in shared_data.undo_commands)
+        shared_data.undo_commands.clear()
+
+    open(undo_file, "w").close()
+    try:
+        # ____________USERS, DEPOTS AND STREAMS____________
+        row_count = 0
+        for slice_number, rows_slice in enumerate(slices(rows, chunk_size), 1):
+            row_count += len(rows_slice)
+            roster = Roster()
+            for row in rows_slice:
+                roster.append(row)
+            shared_data = new_slice_data(roster)
+            pipeline.plan_users(shared_data)
+            new_groups = spill.add(roster.group_members())
+            shared_data.depots_to_create = [
+                group for group in new_groups if group not in existing_depots
+            ]
+            logger.info(
+                f"Slice {slice_number} ({row_count} rows read): creating "
+                f"{len(shared_data.users_to_create)} users and "
+                f"{len(shared_data.depots_to_create)} depots."
+            )
+            pipeline.create_users(shared_data)
+            write_undo(shared_data)
+            pipeline.create_depots(shared_data)
+            write_undo(shared_data)
+            pipeline.populate_depots(shared_data)
+            stream_template = shared_data.stream_template
+
+        # ____________GROUPS____________
+        # Each group is written once, with its members from every slice.
+        group_count = 0
+        for groups in spill.group_chunks(chunk_size):
+            shared_data = new_slice_data()
+            group_members = spill.members(groups)
+            shared_data.groups_to_process = [
+                {"Group": group, **group_members[group]} for group in groups
+            ]
+            shared_data.groups_to_create = [
+                group
+                for group in shared_data.groups_to_process
+                if group["Group"] not in existing_groups
+            ]
+            shared_data.groups_to_modify = [
+                group
+                for group in shared_data.groups_to_process
+                if group["Group"] in existing_groups
+            ]
+            pipeline.create_groups(shared_data)
+            write_undo(shared_data)
+            group_count += len(groups)
+
+        # _________PERMISSIONS__________
+        # One protections write for every group in the roster.
+        shared_data = new_slice_data()
+        shared_data.permissions_to_create = []
+        current_permissions = set(p4_utils.p4.run("protect", "-o")[0]["Protections"])
+        for groups in spill.group_chunks(chunk_size):
+            shared_data.permissions_to_create.extend(
+                p4_utils.check_permissions(groups, current_permissions)
+            )
+        logger.info(
+            f"Wrote {group_count} groups, "
+            f"adding {len(shared_data.permissions_to_create)} permissions."
+        )
+        pipeline.create_permissions(shared_data)
+
+        # _________VERIFICATION__________
+        # List the server once for every group chunk's checks.
+        listings = p4_utils.fetch_listings(base_data.template_depot["name"])
+        reports = []
+        for groups in spill.group_chunks(chunk_size):
+            group_members = spill.members(groups)
+            users = {
+                user for members in group_members.values() for user in members["Users"]
+            }
+            reports.append(
+                p4_utils.verify_run(
+                    users=users,
+                    group_members=group_members,
+                    depots=groups,
+                    template_depot_name=base_data.template_depot["name"],
+                    populated_depots=[
+                        group for group in groups if group not in existing_depots
+                    ],
+                    listings=listings,
+                )
+            )
+        report = p4_utils.merge_verify_reports(reports)
+        report["queries"] += listings["queries"]
+        return report
+    finally:
+        spill.close()
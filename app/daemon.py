@@ -0,0 +1,124 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import p4_utils
+
+# Create a custom logger
+logger = logging.getLogger("main.daemon")
+
+# A CSV must be unchanged for this many seconds before it is picked up, so
+# files still being copied into the drop folder are left alone.
+SETTLE_SECONDS = 2.0
+
+
+def ensure_logged_in():
+    """Check the calling thread's login and log in again if it has been lost.
+
+    The new login uses P4PASSWD if it is set.
+    """
+    try:
+        p4_utils.p4.run_login("-s")
+    except p4_utils.P4Exception:
+        logger.info("Connection or login lost, logging in again...")
+        p4_utils.reconnect()
+        p4_utils.init(password=os.environ.get("P4PASSWD"))
+
+
+class DropFolderDaemon:
+    """Watches a drop folder and applies each new roster CSV that appears.
+
+    Files move through `processing/` into `done/` or `failed/` subfolders,
+    and the undo commands and verification report for each roster are
+    written next to it and move with it. The server connection and the ServerIndex stay warm
+    between rosters; the index is fully refreshed every `refresh_interval`
+    seconds and updated incrementally after each roster in between.
+    """
+
+    def __init__(
+        self,
+        drop_dir,
+        process_roster,
+        server_index,
+        poll_interval=5.0,
+        refresh_interval=300.0,
+    ):
+        self.drop_dir = Path(drop_dir)
+        self.process_roster = process_roster
+        self.server_index = server_index
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.stop_event = threading.Event()
+        self.processing_dir = self.drop_dir / "processing"
+        self.done_dir = self.drop_dir / "done"
+        self.failed_dir = self.drop_dir / "failed"
+        for directory in (self.processing_dir, self.done_dir, self.failed_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run_forever(self):
+        logger.info(f"Watching {self.drop_dir.absolute()} for roster CSV files...")
+        # Anything left in processing/ was interrupted; apply it again.
+        # Re-applying a roster only creates what is still missing.
+        for csv_file in sorted(self.processing_dir.glob("*.csv")):
+            shutil.move(str(csv_file), str(self.drop_dir / csv_file.name))
+        # Undo commands and reports of interrupted rosters are kept in failed/.
+        for output_file in sorted(self.processing_dir.iterdir()):
+            shutil.move(str(output_file), str(self.failed_dir / output_file.name))
+        while not self.stop_event.is_set():
+            try:
+                self.keep_warm()
+                self.poll_once()
+            except p4_utils.P4Exception as e:
+                logger.error(f"Server error, will retry: {e}")
+            self.stop_event.wait(self.poll_interval)
+
+    def keep_warm(self):
+        ensure_logged_in()
+        if self.server_index.age() > self.refresh_interval:
+            self.server_index.refresh()
+
+    def ready_files(self):
+        now = time.time()
+        return sorted(
+            (
+                path
+                for path in self.drop_dir.glob("*.csv")
+                if now - path.stat().st_mtime >= SETTLE_SECONDS
+            ),
+            key=lambda path: path.stat().st_mtime,
+        )
+
+    def poll_once(self):
+        for csv_file in self.ready_files():
+            if self.stop_event.is_set():
+                return
+            stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            processing_file = self.processing_dir / csv_file.name
+            shutil.move(str(csv_file), str(processing_file))
+            logger.info(f"Applying roster {csv_file.name}...")
+            start = time.monotonic()
+            try:
+                # Outputs are written next to the roster and moved with it.
+                ok = self.process_roster(processing_file, self.processing_dir, stamp)
+            except Exception as e:
+                logger.exception(f"Error applying roster {csv_file.name}: {e}")
+                ok = False
+            target_dir = self.done_dir if ok else self.failed_dir
+            shutil.move(
+                str(processing_file), str(target_dir / f"{stamp}_{csv_file.name}")
+            )
+            prefix = f"{stamp}_{csv_file.stem}_"
+            for output_file in list(self.processing_dir.iterdir()):
+                if output_file.name.startswith(prefix):
+                    shutil.move(str(output_file), str(target_dir / output_file.name))
+            logger.info(
+                f"Roster {csv_file.name} {'applied' if ok else 'FAILED'} in "
+                f"{time.monotonic() - start:.1f}s -> {target_dir}"
+            )
@@ -0,0 +1,227 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Create a custom logger
+logger = logging.getLogger("main.enrollment")
+
+# How long to keep collecting events after the first one arrives before
+# applying them together, and the most events applied in one batch.
+COALESCE_WINDOW = 2.0
+MAX_BATCH_EVENTS = 5000
+
+
+class EnrollmentError(Exception):
+    pass
+
+
+def merge_events(events, validate_row):
+    """Reduce a batch of add/remove events to its net effect.
+
+    Events look like {"action": "add", "name": ..., "email": ..., "group": ...,
+    "owner": bool} or {"action": "remove", "user" (or "email"): ..., "group": ...}.
+    When the same user/group pair appears more than once, the last event wins.
+    Returns (rows, removals): validated roster rows for the adds and
+    {group: [usernames]} for the removes.
+    """
+    net = {}
+    for event in events:
+        action = event.get("action")
+        group = str(event.get("group", "")).strip()
+        if action == "add":
+            row = validate_row(
+                0,
+                [
+                    str(event.get("name", "")),
+                    str(event.get("email", "")),
+                    group,
+                    "true" if event.get("owner") else "",
+                ],
+            )
+            user = row[1].split("@")[0]
+            net[(user, row[2])] = row
+        elif action == "remove":
+            user = str(event.get("user") or event.get("email", "")).split("@")[0]
+            if not user or not group:
+                raise EnrollmentError(f"Remove event needs a user and a group: {event}")
+            net[(user, group)] = None
+        else:
+            raise EnrollmentError(f"Unknown action {action!r} in event: {event}")
+    rows = [row for row in net.values() if row is not None]
+    removals = {}
+    for (user, group), row in net.items():
+        if row is None:
+            removals.setdefault(group, []).append(user)
+    return rows, removals
+
+
+class EnrollmentCoalescer:
+    """Queues enrollment events and applies them in coalesced batches.
+
+    apply_batch(rows, removals) is called from a single background thread, so
+    batches never overlap. It should return True if the batch was applied
+    cleanly. Everything that touches the server lives in apply_batch, which
+    makes the queueing and HTTP layers easy to drive against a local test
+    server (or a stub apply_batch).
+    """
+
+    def __init__(
+        self,
+        apply_batch,
+        validate_row,
+        window=COALESCE_WINDOW,
+        max_batch=MAX_BATCH_EVENTS,
+    ):
+        self.apply_batch = apply_batch
+        self.validate_row = validate_row
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.first_event_at = None
+        self.batch_count = 0
+        self.results = deque(maxlen=20)
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def submit(self, events):
+        # Validate up front so the caller hears about bad events immediately.
+        merge_events(events, self.validate_row)
+        with self.condition:
+            if not self.pending:
+                self.first_event_at = time.monotonic()
+            self.pending.extend(events)
+            self.condition.notify_all()
+            return len(self.pending)
+
+    def status(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "batches": self.batch_count,
+                "recent": list(self.results),
+            }
+
+    def _next_batch(self):
+        with self.condition:
+            while True:
+                if self.pending:
+                    wait = self.first_event_at + self.window - time.monotonic()
+                    if wait <= 0 or len(self.pending) >= self.max_batch or self.stopped:
+                        break
+                    self.condition.wait(wait)
+                elif self.stopped:
+                    return None
+                else:
+                    self.condition.wait()
+            batch = self.pending[: self.max_batch]
+            self.pending = self.pending[self.max_batch :]
+            self.first_event_at = time.monotonic() if self.pending else None
+            self.batch_count += 1
+            return self.batch_count, batch
+
+    def run(self):
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            batch_id, events = next_batch
+            result = {
+                "batch": batch_id,
+                "events": len(events),
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            try:
+                rows, removals = merge_events(events, self.validate_row)
+                logger.info(
+                    f"Applying batch {batch_id}: {len(events)} events -> "
+                    f"{len(rows)} adds, {sum(len(u) for u in removals.values())} removes "
+                    f"in {len({row[2] for row in rows} | set(removals))} groups"
+                )
+                result["ok"] = bool(self.apply_batch(rows, removals))
+            except Exception as e:
+                logger.exception(f"Error applying batch {batch_id}: {e}")
+                result["ok"] = False
+                result["error"] = str(e)
+            with self.condition:
+                self.results.append(result)
+
+
+class EnrollmentRequestHandler(BaseHTTPRequestHandler):
+    """POST /events with one event or a list of events; GET /status."""
+
+    coalescer = None
+
+    def _send_json(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._send_json(404, {"error": "Not found"})
+            return
+        self._send_json(200, self.coalescer.status())
+
+    def do_POST(self):
+        if self.path != "/events":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            events = json.loads(self.rfile.read(length) or b"null")
+            if isinstance(events, dict):
+                events = [events]
+            if not isinstance(events, list) or not all(
+                isinstance(event, dict) for event in events
+            ):
+                raise EnrollmentError("Body must be an event object or a list of them.")
+            pending = self.coalescer.submit(events)
+        except Exception as e:
+            # Bad JSON, a malformed event, or validate_row rejecting a field.
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(202, {"accepted": len(events), "pending": pending})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+def serve(coalescer, port, host="127.0.0.1", on_ready=None):
+    """Serve the enrollment API for coalescer until interrupted or shut down.
+
+    on_ready(server) is called once the server is listening, e.g. to find the
+    port when port is 0 or to call server.shutdown() from another thread.
+    """
+    handler = type(
+        "BoundEnrollmentRequestHandler",
+        (EnrollmentRequestHandler,),
+        {"coalescer": coalescer},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    port = server.server_address[1]
+    logger.info(f"Enrollment API listening on http://{host}:{port}/events")
+    coalescer.start()
+    try:
+        if on_ready:
+            on_ready(server)
+        server.serve_forever()
+    finally:
+        server.server_close()
+        coalescer.stop()
@@ -1,13 +1,16 @@
 import sys
+import atexit
 import csv
+import json
 import re
 import os
 import logging
 import configparser
 import argparse
+import itertools
+import threading
 from datetime import datetime
 from pathlib import Path
-from collections import defaultdict
 import traceback
 
 
@@ -15,8 +18,7 @@ from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
     QStackedWidget,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
     QHeaderView,
     QVBoxLayout,
     QHBoxLayout,
@@ -30,9 +32,25 @@ from PyQt6.QtWidgets import (
     QLineEdit,
     QProgressBar,
 )
-from PyQt6.QtCore import Qt, QObject, pyqtSignal, QRunnable, pyqtSlot, QThreadPool
+from PyQt6.QtCore import (
+    Qt,
+    QObject,
+    pyqtSignal,
+    QRunnable,
+    pyqtSlot,
+    QThreadPool,
+    QAbstractTableModel,
+    QModelIndex,
+)
 
 import p4_utils
+import chunked
+import daemon
+import enrollment
+import pipeline
+import profiling
+from pipeline import SharedData
+from roster import Roster
 
 
 def custom_exception_hook(exc_type, exc_value, exc_traceback):
@@ -58,6 +76,9 @@ logger.setLevel(logging.DEBUG)
 
 LOG_FILE = "log.txt"
 UNDO_FILE = datetime.now().strftime("undo_commands_%Y-%m-%d_%H-%M-%S.txt")
+TEARDOWN_FILE = datetime.now().strftime("teardown_plan_%Y-%m-%d_%H-%M-%S.json")
+VERIFY_FILE = datetime.now().strftime("verify_report_%Y-%m-%d_%H-%M-%S.json")
+TEMPLATE_CATALOG_FILE = "template_catalog.json"
 CONFIG_FILE = Path("config.ini")
 
 
@@ -103,6 +124,9 @@ EMAIL_DOMAIN = r"[^@]+\.[^@]+"
 # and the user will be prompted to create one at first login.
 DEFAULT_PASSWORD = ""
 REQUIRE_PASSWORD_RESET = True
+# Upper bound for concurrent server operations. The actual number adapts
+# to server latency and errors, see p4_utils.AdaptiveLimiter.
+MAX_CONCURRENCY = 8
 CSV_FIELDS = [
     {"label": "Name", "validation": lambda s: s or None},
     {
@@ -135,6 +159,10 @@ class CSV_VALIDATION_ERROR(Exception):
 
 
 def validate_csv_row(i: int, row: list) -> list:
+    if len(row) != len(CSV_FIELDS):
+        raise CSV_VALIDATION_ERROR(
+            f"CSV row invalid: \n{row} \n\nExpected {len(CSV_FIELDS)} columns but found {len(row)}."
+        )
     formatted_row = []
     for column, data in enumerate(row):
         logger.debug(
@@ -149,11 +177,132 @@ def validate_csv_row(i: int, row: list) -> list:
     return formatted_row
 
 
-class SharedData:
-    def __init__(self):
-        self.table_data = []
-        self.template_depot = None
-        self.undo_commands = []
+class RosterTableModel(QAbstractTableModel):
+    """Presents the shared Roster directly, so rows are not copied into cells."""
+
+    def __init__(self, shared_data, parent=None):
+        super().__init__(parent)
+        self.shared_data = shared_data
+
+    def reset(self):
+        self.beginResetModel()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.shared_data.roster)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(CSV_FIELDS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            row = self.shared_data.roster[index.row()]
+            return str(row.as_list()[index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if (
+            role == Qt.ItemDataRole.DisplayRole
+            and orientation == Qt.Orientation.Horizontal
+        ):
+            return CSV_FIELDS[section]["label"]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemFlag.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or not index.isValid():
+            return False
+        field = CSV_FIELDS[index.column()]
+        formatted_value = field["validation"](str(value).strip())
+        if formatted_value is None:
+            QMessageBox.warning(
+                None,
+                "Invalid CSV Entry",
+                f"'{value}' is not a valid '{field['label']}'.",
+            )
+            return False
+        self.shared_data.roster.update(index.row(), index.column(), formatted_value)
+        self.dataChanged.emit(index, index)
+        return True
+
+
+def iter_roster_rows(filename):
+    """Yield each validated row of a roster CSV as it is read.
+
+    Raises CSV_VALIDATION_ERROR on a bad row.
+    """
+    with open(filename, "r", encoding="utf-8-sig") as csv_file:
+        reader = csv.reader(csv_file, delimiter=",", quotechar='"')
+        for row_number, row_data in enumerate(reader):
+            if not row_data:
+                continue
+            if (
+                row_number == 0
+                and row_data[0].lower() == CSV_FIELDS[0]["label"].lower()
+            ):
+                logger.debug("Skipping header row.")
+                continue
+            row_data = validate_csv_row(row_number, row_data)
+            logger.debug(f"Row {row_number}: {row_data}")
+            yield row_data
+
+
+def load_roster(filename) -> Roster:
+    """Read and validate a roster CSV. Raises CSV_VALIDATION_ERROR on a bad row."""
+    roster = Roster()
+    with profiling.stage("load_csv"):
+        for row_data in iter_roster_rows(filename):
+            roster.append(row_data)
+    return roster
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def describe_template(entry) -> str:
+    streams = len(entry["streams"])
+    return (
+        f"{streams} streams, {entry['file_count']:,} files "
+        f"({format_size(entry['file_size'])}) per depot"
+    )
+
+
+class CatalogSignals(QObject):
+    depots = pyqtSignal(object)
+    template = pyqtSignal(object)
+    finished = pyqtSignal()
+
+
+class CatalogLoader(QRunnable):
+    """Loads or validates every template in a TemplateCatalog in the background."""
+
+    def __init__(self, catalog):
+        super(CatalogLoader, self).__init__()
+
+        self.catalog = catalog
+        self.signals = CatalogSignals()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.catalog.refresh(
+                callback=self.signals.template.emit,
+                depots_callback=self.signals.depots.emit,
+            )
+        except p4_utils.P4Exception as e:
+            logger.error(f"Unable to load template depots: {e}")
+        finally:
+            p4_utils.release_connection()
+        self.signals.finished.emit()
 
 
 class LoadCsvWindow(QWidget):
@@ -175,9 +324,9 @@ class LoadCsvWindow(QWidget):
         main_layout.addLayout(load_layout)
 
         # Set up the table for viewing CSV data
-        self.table = QTableWidget()
-        self.table.setColumnCount(len(CSV_FIELDS))
-        self.table.setHorizontalHeaderLabels([field["label"] for field in CSV_FIELDS])
+        self.table_model = RosterTableModel(self.shared_data)
+        self.table = QTableView()
+        self.table.setModel(self.table_model)
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
         header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
@@ -194,27 +343,37 @@ class LoadCsvWindow(QWidget):
                 '(Template depots must include "template" in the name to show up here.)'
             )
         )
-        self.template_combo = QComboBox(self)
-        self.template_depots = p4_utils.get_template_depots()
-        self.shared_data.template_depot = (
-            self.template_depots[0] if self.template_depots else None
+        # Templates from the last run are listed straight away; the catalog is
+        # then checked against the server in the background.
+        self.catalog = p4_utils.TemplateCatalog(
+            Path(LOG_FILE).absolute().parent / TEMPLATE_CATALOG_FILE
         )
-        self.template_combo.addItems([depot["name"] for depot in self.template_depots])
+        self.shared_data.template_catalog = self.catalog
+        self.template_depots = []
+        self.template_combo = QComboBox(self)
         self.template_combo.currentIndexChanged.connect(self.set_template_depot)
         main_layout.addWidget(self.template_combo)
+        self.template_info_label = QLabel("Loading template depots...")
+        main_layout.addWidget(self.template_info_label)
 
         # Set up the button box at the bottom of the window
         button_layout = QHBoxLayout()
         self.next_button = QPushButton("Go to Creation Page")
         self.next_button.clicked.connect(self.go_to_creation)
         self.next_button.setEnabled(False)
-        self.enable_next_if_ready()
         button_layout.addWidget(self.next_button)
         main_layout.addLayout(button_layout)
 
         # Set the main layout of the window
         self.setLayout(main_layout)
 
+        self.set_template_depots(self.catalog.cached_depots())
+        self.threadpool = QThreadPool()
+        catalog_loader = CatalogLoader(self.catalog)
+        catalog_loader.signals.depots.connect(self.set_template_depots)
+        catalog_loader.signals.template.connect(self.template_loaded)
+        self.threadpool.start(catalog_loader)
+
     def load_csv_file(self):
         filename, _ = QFileDialog.getOpenFileName(
             self, "Open CSV", "", "CSV Files (*.csv)"
@@ -223,64 +382,73 @@ class LoadCsvWindow(QWidget):
             self.load_csv_data(filename)
 
     def load_csv_data(self, filename):
-        self.shared_data.table_data = []
-        with open(filename, "r", encoding="utf-8-sig") as csv_file:
-            reader = list(csv.reader(csv_file, delimiter=",", quotechar='"'))
-            self.table.setRowCount(0)
-            start_index = 0
-            if reader[0][0].lower() == CSV_FIELDS[0]["label"].lower():
-                logger.debug("Skipping header row.")
-                start_index = 1
-            for row_number, row_data in enumerate(reader[start_index:]):
-                try:
-                    row_data = validate_csv_row(row_number, row_data)
-                    logger.debug(f"Row {row_number}: {row_data}")
-                except CSV_VALIDATION_ERROR as e:
-                    QMessageBox.warning(None, "Invalid CSV Entry", str(e))
-                    logger.error(f"Invalid CSV Entry: {e}")
-                    return
-                if not row_data:
-                    continue
-                self.table.insertRow(row_number)
-                self.shared_data.table_data.append(row_data)
-                for column_number, data in enumerate(row_data):
-                    self.table.setItem(
-                        row_number, column_number, QTableWidgetItem(str(data))
-                    )
-
-            # Resize the columns to fit the data
-            self.table.resizeColumnsToContents()
-            self.enable_next_if_ready()
+        try:
+            self.shared_data.roster = load_roster(filename)
+        except CSV_VALIDATION_ERROR as e:
+            QMessageBox.warning(None, "Invalid CSV Entry", str(e))
+            logger.error(f"Invalid CSV Entry: {e}")
+            self.shared_data.roster = Roster()
+        self.table_model.reset()
+
+        # Resize the columns to fit the data
+        self.table.resizeColumnsToContents()
+        self.enable_next_if_ready()
 
     def enable_next_if_ready(self):
-        if (
-            len(self.shared_data.table_data) > 0
-            and len(self.shared_data.table_data[0]) == len(CSV_FIELDS)
-            and self.shared_data.template_depot
-        ):
+        if len(self.shared_data.roster) > 0 and self.shared_data.template_depot:
             self.next_button.setEnabled(True)
         else:
             self.next_button.setEnabled(False)
 
     def go_to_creation(self):
-        self.shared_data.table_data = []
-        for row in range(self.table.rowCount()):
-            row_data = []
-            for column in range(self.table.columnCount()):
-                cell = self.table.item(row, column)
-                row_data.append(cell.text())
-            self.shared_data.table_data.append(row_data)
-
+        # The depot worker loads the selected template's streams (from the
+        # catalog when they are still current) off the GUI thread.
+        self.shared_data.stream_template = None
         self.parent().push(CombinedWindow(self.shared_data))
 
+    def set_template_depots(self, depots):
+        current = self.shared_data.template_depot
+        self.template_depots = depots
+        self.template_combo.blockSignals(True)
+        self.template_combo.clear()
+        self.template_combo.addItems([depot["name"] for depot in depots])
+        self.template_combo.blockSignals(False)
+        names = [depot["name"] for depot in depots]
+        index = names.index(current["name"]) if current and current["name"] in names else 0
+        if depots:
+            self.template_combo.setCurrentIndex(index)
+        self.set_template_depot(index)
+
     def set_template_depot(self, index):
-        self.shared_data.template_depot = self.template_depots[index]
+        self.shared_data.template_depot = (
+            self.template_depots[index]
+            if 0 <= index < len(self.template_depots)
+            else None
+        )
+        self.show_template_info()
         self.enable_next_if_ready()
 
+    def template_loaded(self, entry):
+        template_depot = self.shared_data.template_depot
+        if template_depot and template_depot["name"] == entry["name"]:
+            self.show_template_info()
+
+    def show_template_info(self):
+        template_depot = self.shared_data.template_depot
+        if not template_depot:
+            self.template_info_label.setText("No template depots found yet.")
+            return
+        entry = self.catalog.get(template_depot["name"])
+        self.template_info_label.setText(
+            describe_template(entry) if entry else "Measuring template..."
+        )
+
 
 class Signals(QObject):
     finished = pyqtSignal()
+    failed = pyqtSignal(str)
     progress = pyqtSignal(int)
+    result = pyqtSignal(object)
 
 
 class Creator(QRunnable):
@@ -293,8 +461,52 @@ class Creator(QRunnable):
 
     @pyqtSlot()
     def run(self):
-        self.func(self.list_to_create, self.signals.progress)
-        self.signals.finished.emit()
+        # Exactly one of finished or failed is emitted, so the window always
+        # moves on and can tell whether the stage succeeded.
+        try:
+            result = self.func(self.list_to_create, self.signals.progress)
+        except Exception as e:
+            logger.exception(f"Error in {self.func.__name__}: {e}")
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.result.emit(result)
+            self.signals.finished.emit()
+        finally:
+            p4_utils.release_connection()
+
+
+class PlannerSignals(QObject):
+    ready = pyqtSignal(str)
+    cancelled = pyqtSignal(str)
+    failed = pyqtSignal(str, str)
+
+
+class Planner(QRunnable):
+    """Runs one planning section of pipeline.prepare_data in the background."""
+
+    def __init__(self, section, shared_data, cancel_event):
+        super(Planner, self).__init__()
+
+        self.section = section
+        self.shared_data = shared_data
+        self.cancel_event = cancel_event
+        self.signals = PlannerSignals()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            with p4_utils.cancellable(self.cancel_event):
+                pipeline.PLAN_SECTIONS[self.section](self.shared_data)
+        except p4_utils.P4CancelledException:
+            logger.debug(f"Planning {self.section} was cancelled.")
+            self.signals.cancelled.emit(self.section)
+        except Exception as e:
+            logger.exception(f"Error planning {self.section}: {e}")
+            self.signals.failed.emit(self.section, str(e))
+        else:
+            self.signals.ready.emit(self.section)
+        finally:
+            p4_utils.release_connection()
 
 
 class CombinedWindow(QWidget):
@@ -302,8 +514,10 @@ class CombinedWindow(QWidget):
         super().__init__(parent=parent)
         self.shared_data = shared_data
         self.threadpool = QThreadPool()
-
-        self.prepare_data()
+        self.populated = False
+        self.cancel_event = threading.Event()
+        self.pending_sections = set(pipeline.PLAN_SECTIONS)
+        self.planning_failed = False
 
         # Set up the main Vertical Layout
         self.main_layout = QVBoxLayout()
@@ -323,52 +537,66 @@ class CombinedWindow(QWidget):
         )
         self.main_layout.addWidget(log_label)
 
+        # Each section starts as a placeholder and is filled in as soon as its
+        # server queries finish (see section_ready).
         # __USERS__
-        self.user_button, self.user_progress = self.create_widgets(
-            label_text=f"Create <b>{len(self.shared_data.users_to_create)}</b> new users. (Seats remaining on server: {self.shared_data.remaining_licenses})",
-            button_text="Create Users",
+        self.user_label, self.user_button, self.user_progress = self.create_widgets(
+            label_text="Checking users...",
             button_method=self.create_users,
-            item_count=len(self.shared_data.users_to_create),
         )
 
         # __GROUPS__
-        self.group_button, self.group_progress = self.create_widgets(
-            label_text=f"Creating/Updating {len(self.shared_data.groups_to_process)} Groups:",
-            button_text="Update Groups",
+        self.group_label, self.group_button, self.group_progress = self.create_widgets(
+            label_text="Checking groups...",
             button_method=self.create_groups,
-            item_count=len(self.shared_data.groups_to_process),
         )
 
         # __PERMISSIONS__
-        self.permission_button, self.permission_progress = self.create_widgets(
-            label_text=f"Creating {len(self.shared_data.permissions_to_create)} Permissions:",
-            button_text="Create Permissions",
+        (
+            self.permission_label,
+            self.permission_button,
+            self.permission_progress,
+        ) = self.create_widgets(
+            label_text="Checking permissions...",
             button_method=self.create_permissions,
-            item_count=1 if self.shared_data.permissions_to_create else 0,
         )
 
         # __DEPOTS__
-        self.depot_button, self.depot_progress = self.create_widgets(
-            label_text=f"Creating {len(self.shared_data.depots_to_create)} Depots:",
-            button_text="Create Depots",
+        self.depot_label, self.depot_button, self.depot_progress = self.create_widgets(
+            label_text="Checking depots...",
             button_method=self.create_depots,
-            item_count=len(self.shared_data.depots_to_create),
         )
 
         # __POPULATE DEPOTS__
-        self.populate_button, self.populate_progress = self.create_widgets(
-            label_text=f"Populating {len(self.shared_data.depots_to_create)} Depots:",
-            button_text="Awaiting Depots",
+        (
+            self.populate_label,
+            self.populate_button,
+            self.populate_progress,
+        ) = self.create_widgets(
+            label_text="Checking depots...",
             button_method=self.populate_depots,
-            item_count=len(self.shared_data.depots_to_create),
         )
-        self.populate_button.setEnabled(False)
+
+        # __VERIFY__
+        self.verify_label = QLabel(
+            f"Verify all planned objects exist. Report will be written to <code>{Path(VERIFY_FILE).absolute()}</code>"
+        )
+        self.main_layout.addWidget(self.verify_label)
+        verify_layout = QHBoxLayout()
+        self.verify_button = QPushButton("Verify Results")
+        self.verify_button.clicked.connect(self.verify_results)
+        self.verify_button.setEnabled(False)
+        verify_layout.addWidget(self.verify_button)
+        self.main_layout.addLayout(verify_layout)
 
         # Set up the button box at the bottom of the window
         button_layout = QHBoxLayout()
         self.back_button = QPushButton("Back")
-        self.back_button.clicked.connect(lambda: self.parent().pop())
+        self.back_button.clicked.connect(self.go_back)
         button_layout.addWidget(self.back_button)
+        self.cancel_button = QPushButton("Cancel Checks")
+        self.cancel_button.clicked.connect(self.cancel_planning)
+        button_layout.addWidget(self.cancel_button)
         self.next_button = QPushButton("Close")
         self.next_button.clicked.connect(QApplication.instance().quit)
         button_layout.addWidget(self.next_button)
@@ -377,89 +605,164 @@ class CombinedWindow(QWidget):
         # Set the main layout of the window
         self.setLayout(self.main_layout)
 
-    def prepare_data(self):
-        logger.debug("Preparing Data:")
+        self.start_planning()
 
-        # ____________USERS____________
-        users = [
-            {
-                "User": row[1].split("@")[0],
-                "Email": row[1],
-                "FullName": row[0],
-            }
-            for row in self.shared_data.table_data
-        ]
-        self.shared_data.users_to_create = p4_utils.check_users(users)
-        logger.debug(f"Users to create: {self.shared_data.users_to_create}")
-        try:
-            self.shared_data.remaining_licenses = p4_utils.check_remaining_seats()
-        except p4_utils.P4Exception as e:
-            logger.error(f"Unable to check remaining seats: {e}")
-            self.shared_data.remaining_licenses = 0
-
-        # ____________GROUPS____________
-        existing_groups = p4_utils.get_existing_groups()
-        group_users = defaultdict(lambda: {"Users": [], "Owners": []})
-        for row in self.shared_data.table_data:
-            if row[3] == "True":
-                group_users[row[2]]["Owners"].append(row[1].split("@")[0])
-            group_users[row[2]]["Users"].append(row[1].split("@")[0])
-        self.shared_data.groups_to_process = [
-            {
-                "Group": group,
-                "Users": group_users[group]["Users"],
-                "Owners": group_users[group]["Owners"],
-            }
-            for group in group_users
-        ]
-        self.shared_data.groups_to_create = [
-            group
-            for group in self.shared_data.groups_to_process
-            if not any(eg for eg in existing_groups if eg["Group"] == group["Group"])
-        ]
-        self.shared_data.groups_to_modify = [
-            group
-            for group in self.shared_data.groups_to_process
-            if any(eg for eg in existing_groups if eg["Group"] == group["Group"])
-        ]
-        logger.debug(f"Groups to create: {self.shared_data.groups_to_create}")
-        logger.debug(f"Groups to modify: {self.shared_data.groups_to_modify}")
-
-        # _________DEPOTS__________
-        unique_depots = list(group_users)
-        self.shared_data.depots_to_create = p4_utils.check_depots(unique_depots)
-        logger.debug(f"Depots to create: {self.shared_data.depots_to_create}")
-
-        # _________PERMISSIONS__________
-        self.shared_data.permissions_to_create = p4_utils.check_permissions(
-            unique_depots
-        )
-        logger.debug(f"Permissions to create: {self.shared_data.permissions_to_create}")
-
-    def create_widgets(self, label_text, button_text, button_method, item_count):
+    def create_widgets(self, label_text, button_method):
         # Add label
-        self.main_layout.addWidget(QLabel(label_text))
+        operation_label = QLabel(label_text)
+        self.main_layout.addWidget(operation_label)
 
         # Create layout for button and progress bar
         operation_layout = QHBoxLayout()
 
-        # Add button
-        operation_button = QPushButton(button_text if item_count > 0 else "Done")
+        # Add button, disabled until the section has been planned
+        operation_button = QPushButton("Waiting for server...")
         operation_button.clicked.connect(button_method)
-        if item_count == 0:
-            operation_button.setEnabled(False)
+        operation_button.setEnabled(False)
         operation_layout.addWidget(operation_button)
 
-        # Add progress bar
+        # Add progress bar, busy until the section has been planned
         operation_progress = QProgressBar(self)
-        operation_progress.setMaximum(item_count if item_count > 0 else 1)
-        operation_progress.setValue(0 if item_count > 0 else 1)
+        operation_progress.setMaximum(0)
         operation_layout.addWidget(operation_progress)
 
         # Add layout to main layout
         self.main_layout.addLayout(operation_layout)
 
-        return operation_button, operation_progress
+        return operation_label, operation_button, operation_progress
+
+    def update_widgets(
+        self, widgets, label_text, button_text, item_count, enabled=True
+    ):
+        operation_label, operation_button, operation_progress = widgets
+        operation_label.setText(label_text)
+        operation_button.setText(button_text if item_count > 0 else "Done")
+        operation_button.setEnabled(enabled and item_count > 0)
+        operation_progress.setMaximum(item_count if item_count > 0 else 1)
+        operation_progress.setValue(0 if item_count > 0 else 1)
+
+    def start_planning(self):
+        logger.debug("Preparing Data:")
+        for section in pipeline.PLAN_SECTIONS:
+            planner = Planner(section, self.shared_data, self.cancel_event)
+            planner.signals.ready.connect(self.section_ready)
+            planner.signals.cancelled.connect(self.section_stopped)
+            planner.signals.failed.connect(self.section_failed)
+            self.threadpool.start(planner)
+
+    def cancel_planning(self):
+        logger.debug("Cancelling planning.")
+        self.cancel_event.set()
+        self.cancel_button.setEnabled(False)
+
+    def go_back(self):
+        self.cancel_planning()
+        self.parent().pop()
+
+    def section_widgets(self, section):
+        return {
+            "users": [(self.user_label, self.user_button, self.user_progress)],
+            "groups": [(self.group_label, self.group_button, self.group_progress)],
+            "permissions": [
+                (
+                    self.permission_label,
+                    self.permission_button,
+                    self.permission_progress,
+                )
+            ],
+            "depots": [
+                (self.depot_label, self.depot_button, self.depot_progress),
+                (self.populate_label, self.populate_button, self.populate_progress),
+            ],
+        }[section]
+
+    def section_ready(self, section):
+        if section == "users":
+            self.update_widgets(
+                self.section_widgets(section)[0],
+                label_text=f"Create <b>{len(self.shared_data.users_to_create)}</b> new users. (Seats remaining on server: {self.shared_data.remaining_licenses})",
+                button_text="Create Users",
+                item_count=len(self.shared_data.users_to_create),
+            )
+        elif section == "groups":
+            self.update_widgets(
+                self.section_widgets(section)[0],
+                label_text=f"Creating/Updating {len(self.shared_data.groups_to_process)} Groups:",
+                button_text="Update Groups",
+                item_count=len(self.shared_data.groups_to_process),
+            )
+        elif section == "permissions":
+            self.update_widgets(
+                self.section_widgets(section)[0],
+                label_text=f"Creating {len(self.shared_data.permissions_to_create)} Permissions:",
+                button_text="Create Permissions",
+                item_count=1 if self.shared_data.permissions_to_create else 0,
+            )
+        elif section == "depots":
+            depot_widgets, populate_widgets = self.section_widgets(section)
+            depot_count = len(self.shared_data.depots_to_create)
+            catalog = self.shared_data.template_catalog
+            entry = catalog and catalog.get(self.shared_data.template_depot["name"])
+            stream_text = populate_text = ""
+            if entry:
+                stream_text = f" with {len(entry['streams'])} streams each"
+                populate_text = (
+                    f" {entry['file_count']:,} files ({format_size(entry['file_size'])}) each, "
+                    f"<b>{entry['file_count'] * depot_count:,} files "
+                    f"({format_size(entry['file_size'] * depot_count)})</b> in total"
+                )
+            self.update_widgets(
+                depot_widgets,
+                label_text=f"Creating {depot_count} Depots{stream_text}:",
+                button_text="Create Depots",
+                item_count=depot_count,
+            )
+            self.update_widgets(
+                populate_widgets,
+                label_text=f"Populating {depot_count} Depots:{populate_text}",
+                button_text="Awaiting Depots",
+                item_count=len(self.shared_data.depots_to_create),
+                enabled=False,
+            )
+        self.section_finished(section)
+
+    def section_stopped(self, section):
+        for widgets in self.section_widgets(section):
+            operation_label, operation_button, operation_progress = widgets
+            operation_label.setText(f"Checking {section} was cancelled.")
+            operation_button.setText("Cancelled")
+            operation_progress.setMaximum(1)
+        self.section_finished(section, complete=False)
+
+    def section_failed(self, section, error):
+        for widgets in self.section_widgets(section):
+            operation_label, operation_button, operation_progress = widgets
+            operation_label.setText(f"<b>Error checking {section}:</b> {error}")
+            operation_button.setText("Unavailable")
+            operation_progress.setMaximum(1)
+        self.section_finished(section, complete=False)
+
+    def section_finished(self, section, complete=True):
+        self.pending_sections.discard(section)
+        self.planning_failed = self.planning_failed or not complete
+        if not self.pending_sections:
+            self.cancel_button.setEnabled(False)
+            self.verify_button.setEnabled(not self.planning_failed)
+
+    def stage_failed(self, widgets, action):
+        """A slot that shows a creation step stopped with an error.
+
+        The undo commands of whatever the step did create are still written.
+        """
+        operation_label, operation_button, operation_progress = widgets
+
+        def show_error(error):
+            operation_label.setText(f"<b>Error {action}:</b> {error}")
+            operation_button.setText("Failed")
+            operation_button.setEnabled(False)
+            self.write_undo_file()
+
+        return show_error
 
     def create_users(self):
         logger.debug("Create users was called.")
@@ -471,36 +774,18 @@ class CombinedWindow(QWidget):
         worker = Creator(self.create_users_worker, self.shared_data.users_to_create)
         worker.signals.progress.connect(self.user_progress.setValue)
         worker.signals.finished.connect(self.users_complete)
+        worker.signals.failed.connect(
+            self.stage_failed(self.section_widgets("users")[0], "creating users")
+        )
         self.threadpool.start(worker)
 
     def create_users_worker(self, users_to_create, progress_callback):
-        global REQUIRE_PASSWORD_RESET
-        for i, user in enumerate(users_to_create):
-            logger.debug(f"User ({i+1}/{len(users_to_create)}) {user}")
-            p4_utils.create_user(
-                {
-                    "User": user["User"],
-                    "Email": user["Email"],
-                    "FullName": user["FullName"],
-                }
-            )
-            logger.debug(f"{res}")
-            pw_res = p4_utils.set_initial_password(
-                user["User"], DEFAULT_PASSWORD, REQUIRE_PASSWORD_RESET
-            )
-            logger.debug(f"Password set: {pw_res}")
-            progress_callback.emit(i + 1)
+        pipeline.create_users(self.shared_data, progress_callback)
 
     def users_complete(self):
         self.user_button.setText("Done")
         self.user_button.setEnabled(False)
-        undo_commands = [
-            f"p4 user -df {user['User']}" for user in self.shared_data.users_to_create
-        ]
-        self.shared_data.undo_commands.extend(undo_commands)
         self.write_undo_file()
-        undo_commands_str = "\n".join(undo_commands)
-        logger.debug(f"Users created. Undo commands below:\n{undo_commands_str}")
 
     def create_groups(self):
         logger.debug("Create groups was called")
@@ -508,32 +793,18 @@ class CombinedWindow(QWidget):
         worker = Creator(self.create_groups_worker, self.shared_data.groups_to_process)
         worker.signals.progress.connect(self.group_progress.setValue)
         worker.signals.finished.connect(self.groups_complete)
+        worker.signals.failed.connect(
+            self.stage_failed(self.section_widgets("groups")[0], "updating groups")
+        )
         self.threadpool.start(worker)
 
     def create_groups_worker(self, groups_to_create, progress_callback):
-        for i, group in enumerate(groups_to_create):
-            p4_utils.create_group(group)
-            progress_callback.emit(i + 1)
+        pipeline.create_groups(self.shared_data, progress_callback)
 
     def groups_complete(self):
         self.group_button.setText("Done")
         self.group_button.setEnabled(False)
-        undo_commands = [
-            "# Commands to delete groups which were added and remove their permissions:"
-        ]
-        undo_commands += [
-            f"p4 group -dF {group['Group']}"
-            for group in self.shared_data.groups_to_create
-        ] or ["# --> No groups were created."]
-        undo_commands += ["# Groups which were modified (cannot easily undo):"]
-        undo_commands += [
-            f"p4 group -o {group['Group']}"
-            for group in self.shared_data.groups_to_modify
-        ] or ["# --> No groups were modified."]
-        undo_commands_str = "\n".join(undo_commands)
-        self.shared_data.undo_commands.extend(undo_commands)
         self.write_undo_file()
-        logger.debug(f"Groups created. Undo commands below:\n{undo_commands_str}")
 
     def create_permissions(self):
         logger.debug("Called create permissions")
@@ -543,63 +814,52 @@ class CombinedWindow(QWidget):
         )
         worker.signals.progress.connect(self.permission_progress.setValue)
         worker.signals.finished.connect(self.permissions_complete)
+        worker.signals.failed.connect(
+            self.stage_failed(
+                self.section_widgets("permissions")[0], "creating permissions"
+            )
+        )
         self.threadpool.start(worker)
 
     def create_permissions_worker(self, permissions_to_create, progress_callback):
-        p4_utils.create_permissions(permissions_to_create)
-        progress_callback.emit(1)
+        pipeline.create_permissions(self.shared_data, progress_callback)
 
     def permissions_complete(self):
         self.permission_button.setText("Done")
         self.permission_button.setEnabled(False)
-        added_lines = "\n".join(self.shared_data.permissions_to_create)
-        logger.debug(
-            f"Permissions created. New lines below. Deleting groups with -dF command should remove permissions lines:\n{added_lines}"
-        )
 
     def create_depots(self):
         logger.debug("Create depots was called")
         self.depot_button.setEnabled(False)
+        # Busy until the worker has loaded the template's streams.
+        self.depot_button.setText("Loading template...")
+        self.depot_progress.setMaximum(0)
         worker = Creator(self.create_depots_worker, self.shared_data.depots_to_create)
-        worker.signals.progress.connect(self.depot_progress.setValue)
+        worker.signals.progress.connect(self.depot_progress_changed)
         worker.signals.finished.connect(self.depots_complete)
+        worker.signals.failed.connect(
+            self.stage_failed(self.section_widgets("depots")[0], "creating depots")
+        )
+        # Stop the busy indicator if the template could not be loaded.
+        worker.signals.failed.connect(lambda error: self.depot_progress.setMaximum(1))
         self.threadpool.start(worker)
 
     def create_depots_worker(self, depots_to_create, progress_callback):
-        depot_type = self.shared_data.template_depot["type"]
-        self.depot_undo = {}
-        for i, depot_name in enumerate(depots_to_create):
-            p4_utils.create_depot(depot_name, depot_type)
-            streams_to_create = p4_utils.get_streams(
-                self.shared_data.template_depot["name"], depot_name
-            )
-            for stream in streams_to_create:
-                p4_utils.create_stream(stream)
-            created_streams = [stream["Stream"] for stream in streams_to_create]
-            logger.debug(f"Created depot {depot_name} with streams {created_streams}")
-            self.depot_undo[depot_name] = reversed(created_streams)
-            progress_callback.emit(i + 1)
+        pipeline.get_stream_template(self.shared_data)
+        progress_callback.emit(0)
+        pipeline.create_depots(self.shared_data, progress_callback)
+
+    def depot_progress_changed(self, value):
+        self.depot_button.setText("Creating Depots...")
+        self.depot_progress.setMaximum(len(self.shared_data.depots_to_create))
+        self.depot_progress.setValue(value)
 
     def depots_complete(self):
         self.depot_button.setText("Done")
         self.depot_button.setEnabled(False)
         self.populate_button.setText("Populate Depots")
         self.populate_button.setEnabled(True)
-        undo_commands = []
-        for depot_name, streams in self.depot_undo.items():
-            undo_commands.extend(
-                f"p4 stream --obliterate -y {stream}" for stream in streams
-            )
-            undo_commands.extend(
-                (
-                    f"p4 obliterate -y //{depot_name}/...",
-                    f"p4 depot -d {depot_name}",
-                )
-            )
-        self.shared_data.undo_commands.extend(undo_commands)
         self.write_undo_file()
-        undo_commands_str = "\n".join(undo_commands)
-        logger.debug(f"Depots created. Undo commands below:\n{undo_commands_str}")
 
     def populate_depots(self):
         logger.debug("Populate depots was called")
@@ -607,25 +867,80 @@ class CombinedWindow(QWidget):
         worker = Creator(self.populate_depots_worker, self.shared_data.depots_to_create)
         worker.signals.progress.connect(self.populate_progress.setValue)
         worker.signals.finished.connect(self.populate_complete)
+        worker.signals.failed.connect(
+            self.stage_failed(self.section_widgets("depots")[1], "populating depots")
+        )
         self.threadpool.start(worker)
 
     def populate_depots_worker(self, depots_to_create, progress_callback):
-        for i, depot_name in enumerate(depots_to_create):
-            try:
-                p4_utils.populate_new_depot(
-                    self.shared_data.template_depot["name"], depot_name
-                )
-            except p4_utils.P4Exception as e:
-                logger.warning(f"Error populating depot {depot_name}: {e}")
-            progress_callback.emit(i + 1)
+        pipeline.populate_depots(self.shared_data, progress_callback)
 
     def populate_complete(self):
         self.populate_button.setText("Done")
         self.populate_button.setEnabled(False)
+        self.populated = True
+
+    def verify_results(self):
+        logger.debug("Verify results was called")
+        self.verify_button.setEnabled(False)
+        self.verify_button.setText("Verifying...")
+        worker = Creator(self.verify_worker, self.shared_data.depots_to_create)
+        worker.signals.result.connect(self.verify_complete)
+        worker.signals.failed.connect(self.verify_failed)
+        self.threadpool.start(worker)
+
+    def verify_worker(self, depots_to_create, progress_callback):
+        return pipeline.verify(self.shared_data, populated=self.populated)
+
+    def verify_failed(self, error):
+        self.verify_button.setText("Verify Again")
+        self.verify_button.setEnabled(True)
+        self.verify_label.setText(f"<b>Error verifying:</b> {error}")
+
+    def verify_complete(self, report):
+        write_verify_report(report)
+        self.verify_button.setText("Verify Again")
+        self.verify_button.setEnabled(True)
+        if report["ok"]:
+            self.verify_label.setText(
+                f"Verification passed ({report['queries']} queries). Report: <code>{Path(VERIFY_FILE).absolute()}</code>"
+            )
+            return
+        self.verify_label.setText(
+            f"<b>Verification failed:</b> {summarize_verify_report(report)} missing or mismatched. Report: <code>{Path(VERIFY_FILE).absolute()}</code>"
+        )
 
     def write_undo_file(self):
-        with open(UNDO_FILE, "w") as f:
-            f.write("\n".join(self.shared_data.undo_commands))
+        write_undo_file(self.shared_data)
+
+
+def write_undo_file(shared_data, undo_file=UNDO_FILE):
+    with open(undo_file, "w") as f:
+        f.write("\n".join(shared_data.undo_commands))
+
+
+def summarize_verify_report(report):
+    problems = {
+        "users": len(report["users"]["missing"]),
+        "groups": len(report["groups"]["missing"]),
+        "group members": len(report["groups"]["missing_members"]),
+        "protections": len(report["protections"]["missing"]),
+        "depots": len(report["depots"]["missing"]),
+        "streams": len(report["streams"]["missing"]),
+        "populated streams": len(report["files"]["mismatched"]),
+    }
+    return ", ".join(f"{count} {name}" for name, count in problems.items() if count)
+
+
+def write_verify_report(report, verify_file=VERIFY_FILE):
+    with open(verify_file, "w") as f:
+        json.dump(report, f, indent=2)
+    if report["ok"]:
+        logger.info(f"Verification passed. Report: {Path(verify_file).absolute()}")
+    else:
+        logger.error(
+            f"Verification failed: {summarize_verify_report(report)} missing or mismatched. See {Path(verify_file).absolute()}"
+        )
 
 
 class StackedWidget(QStackedWidget):
@@ -729,10 +1044,236 @@ class MainWindow(QMainWindow):
         logger.debug("Logged in!")
 
 
+def run_headless(shared_data, csv_file, template_name, chunk_size=None):
+    """Run every stage from CSV to verification without the GUI.
+
+    With chunk_size, the CSV is read and applied that many rows at a time.
+    """
+    p4_utils.init()
+    try:
+        if chunk_size:
+            # Validate every row before applying any slice, without keeping them.
+            for _ in iter_roster_rows(csv_file):
+                pass
+        else:
+            shared_data.roster = load_roster(csv_file)
+    except CSV_VALIDATION_ERROR as e:
+        logger.error(f"Invalid CSV Entry: {e}")
+        return 1
+    template_depots = p4_utils.get_template_depots()
+    shared_data.template_depot = next(
+        (depot for depot in template_depots if depot["name"] == template_name), None
+    )
+    if not shared_data.template_depot:
+        logger.error(
+            f"Template depot {template_name} not found. Available: {[depot['name'] for depot in template_depots]}"
+        )
+        return 1
+
+    if chunk_size:
+        report = chunked.run_chunked(
+            shared_data, iter_roster_rows(csv_file), UNDO_FILE, chunk_size
+        )
+        write_verify_report(report)
+    else:
+        report = apply_roster(shared_data)
+    return 0 if report["ok"] else 2
+
+
+def apply_roster(shared_data, undo_file=UNDO_FILE, verify_file=VERIFY_FILE):
+    """Plan and run every stage for shared_data.roster, then verify the result."""
+    pipeline.prepare_data(shared_data)
+    logger.info(
+        f"Creating {len(shared_data.users_to_create)} users (seats remaining: {shared_data.remaining_licenses}), "
+        f"updating {len(shared_data.groups_to_process)} groups, "
+        f"adding {len(shared_data.permissions_to_create)} permissions, "
+        f"creating and populating {len(shared_data.depots_to_create)} depots."
+    )
+    created = {}
+    try:
+        created["users_created"] = pipeline.create_users(shared_data)
+        write_undo_file(shared_data, undo_file)
+        created["groups_created"] = pipeline.create_groups(shared_data)
+        write_undo_file(shared_data, undo_file)
+        created["permissions_created"] = pipeline.create_permissions(shared_data)
+        created["depots_created"] = pipeline.create_depots(shared_data)
+        write_undo_file(shared_data, undo_file)
+        pipeline.populate_depots(shared_data)
+    finally:
+        # Keep the index accurate even when a later stage failed.
+        pipeline.record_applied(shared_data, **created)
+
+    report = pipeline.verify(shared_data, populated=True)
+    write_verify_report(report, verify_file)
+    return report
+
+
+def run_daemon(config_data, drop_dir, template_name, poll_interval, refresh_interval):
+    """Apply every roster CSV dropped into drop_dir until interrupted."""
+    p4_utils.init()
+    template_depot = next(
+        (
+            depot
+            for depot in p4_utils.get_template_depots()
+            if depot["name"] == template_name
+        ),
+        None,
+    )
+    if not template_depot:
+        logger.error(f"Template depot {template_name} not found.")
+        return 1
+    server_index = p4_utils.ServerIndex()
+    server_index.refresh()
+
+    def process_roster(csv_file, output_dir, stamp):
+        shared_data = SharedData()
+        shared_data.default_password = config_data.default_password
+        shared_data.require_password_reset = config_data.require_password_reset
+        shared_data.template_depot = template_depot
+        shared_data.server_index = server_index
+        try:
+            shared_data.roster = load_roster(csv_file)
+        except CSV_VALIDATION_ERROR as e:
+            logger.error(f"Invalid CSV Entry in {csv_file.name}: {e}")
+            return False
+        report = apply_roster(
+            shared_data,
+            undo_file=output_dir / f"{stamp}_{csv_file.stem}_undo_commands.txt",
+            verify_file=output_dir / f"{stamp}_{csv_file.stem}_verify_report.json",
+        )
+        return report["ok"]
+
+    watcher = daemon.DropFolderDaemon(
+        drop_dir,
+        process_roster,
+        server_index,
+        poll_interval=poll_interval,
+        refresh_interval=refresh_interval,
+    )
+    try:
+        watcher.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping.")
+    return 0
+
+
+def run_api(config_data, port, template_name, window, refresh_interval):
+    """Serve the enrollment-delta API and apply coalesced batches until interrupted."""
+    p4_utils.init()
+    template_depot = next(
+        (
+            depot
+            for depot in p4_utils.get_template_depots()
+            if depot["name"] == template_name
+        ),
+        None,
+    )
+    if not template_depot:
+        logger.error(f"Template depot {template_name} not found.")
+        return 1
+    server_index = p4_utils.ServerIndex()
+    server_index.refresh()
+    output_dir = Path(LOG_FILE).absolute().parent / "enrollment"
+    output_dir.mkdir(exist_ok=True)
+    batch_numbers = itertools.count(1)
+
+    def claim_batch_files():
+        """Create a new batch's undo file and return it with its report file.
+
+        Several batches can finish within one second, so every name also
+        carries a batch number, and "x" refuses to reuse an existing file.
+        """
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        while True:
+            prefix = f"{stamp}_batch{next(batch_numbers):04d}"
+            undo_file = output_dir / f"{prefix}_undo_commands.txt"
+            try:
+                open(undo_file, "x").close()
+            except FileExistsError:
+                continue
+            return undo_file, output_dir / f"{prefix}_verify_report.json"
+
+    def apply_batch(rows, removals):
+        shared_data = SharedData()
+        shared_data.default_password = config_data.default_password
+        shared_data.require_password_reset = config_data.require_password_reset
+        shared_data.template_depot = template_depot
+        shared_data.server_index = server_index
+        for row in rows:
+            shared_data.roster.append(row)
+        shared_data.group_removals = removals
+        undo_file, verify_file = claim_batch_files()
+        try:
+            # Batches can be hours apart, so the ticket may have expired.
+            daemon.ensure_logged_in()
+            if server_index.age() > refresh_interval:
+                server_index.refresh()
+            report = apply_roster(
+                shared_data, undo_file=undo_file, verify_file=verify_file
+            )
+        finally:
+            p4_utils.release_connection()
+        return report["ok"]
+
+    coalescer = enrollment.EnrollmentCoalescer(
+        apply_batch, validate_csv_row, window=window
+    )
+    try:
+        enrollment.serve(coalescer, port)
+    except KeyboardInterrupt:
+        logger.info("Stopping.")
+    return 0
+
+
+def run_teardown(depot_pattern, csv_file, remove_users, max_rate, confirmed):
+    """Remove depots, streams, groups, protections and (optionally) users.
+
+    Without confirmation this only plans and writes the plan to TEARDOWN_FILE.
+    """
+    p4_utils.init()
+    group_names, user_names = [], []
+    if csv_file:
+        try:
+            roster = load_roster(csv_file)
+        except CSV_VALIDATION_ERROR as e:
+            logger.error(f"Invalid CSV Entry: {e}")
+            return 1
+        group_names = roster.groups()
+        user_names = [user["User"] for user in roster.users()]
+
+    plan = p4_utils.plan_teardown(
+        depot_pattern=depot_pattern,
+        group_names=group_names,
+        user_names=user_names,
+        remove_users=remove_users,
+    )
+    with open(TEARDOWN_FILE, "w") as f:
+        json.dump(plan, f, indent=2)
+    stream_count = sum(len(streams) for streams in plan["streams"].values())
+    logger.info(
+        f"Teardown plan: remove {len(plan['protections'])} protections lines, "
+        f"obliterate {stream_count} streams in {len(plan['depots'])} depots, "
+        f"delete {len(plan['groups'])} groups and {len(plan['users'])} users. "
+        f"Full plan: {Path(TEARDOWN_FILE).absolute()}"
+    )
+    if not confirmed:
+        logger.info("Dry run only. Re-run with --yes to apply this plan.")
+        return 0
+
+    rate_limiter = p4_utils.RateLimiter(max_rate) if max_rate else None
+    failures = p4_utils.run_teardown(plan, rate_limiter=rate_limiter)
+    if failures:
+        logger.error(f"Teardown finished with errors: {failures}")
+        return 2
+    logger.info("Teardown complete.")
+    return 0
+
+
 def main():
     global EMAIL_DOMAIN
     global DEFAULT_PASSWORD
     global REQUIRE_PASSWORD_RESET
+    global MAX_CONCURRENCY
 
     parser = argparse.ArgumentParser(
         description="Bulk create users, groups, depots, permissions, and populate from a template depot."
@@ -743,21 +1284,205 @@ def main():
         action="store_true",
         help="Enable verbose logging in console.",
     )
+    parser.add_argument(
+        "--csv",
+        help="Run without the GUI, creating everything in this CSV file.",
+    )
+    parser.add_argument(
+        "--template",
+        help="Name of the template depot to use with --csv.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        metavar="ROWS",
+        help=f"With --csv, read and apply the CSV ROWS rows at a time to keep memory use flat (e.g. {chunked.CHUNK_SIZE}).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write CPU and memory profiles for each stage next to the log file.",
+    )
+    trace_group = parser.add_mutually_exclusive_group()
+    trace_group.add_argument(
+        "--record",
+        metavar="TRACE_FILE",
+        help="Record every server command, its results and latency to TRACE_FILE.",
+    )
+    trace_group.add_argument(
+        "--replay",
+        metavar="TRACE_FILE",
+        help="Answer server commands from a recorded TRACE_FILE instead of a server.",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="Divide recorded latencies by this when replaying; 0 replays without waiting (default 1).",
+    )
+    teardown_group = parser.add_argument_group(
+        "teardown", "Remove a past term's depots, streams, groups and protections."
+    )
+    teardown_group.add_argument(
+        "--teardown",
+        action="store_true",
+        help="Remove everything matching --pattern and/or the groups in --csv.",
+    )
+    teardown_group.add_argument(
+        "--pattern",
+        help='Glob matched against depot and group names, e.g. "202230_356_*".',
+    )
+    teardown_group.add_argument(
+        "--remove-users",
+        action="store_true",
+        help="Also delete users in --csv, or users only in groups being removed.",
+    )
+    teardown_group.add_argument(
+        "--max-rate",
+        type=float,
+        help="Maximum obliterate commands started per second.",
+    )
+    teardown_group.add_argument(
+        "--yes",
+        action="store_true",
+        help="Apply the teardown plan instead of only writing it out.",
+    )
+    daemon_group = parser.add_argument_group(
+        "daemon", "Keep running and apply roster CSVs as they are dropped in a folder."
+    )
+    daemon_group.add_argument(
+        "--daemon",
+        metavar="DROP_DIR",
+        help="Watch DROP_DIR for new roster CSVs and apply each with --template.",
+    )
+    daemon_group.add_argument(
+        "--poll-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between checks of the drop folder (default 5).",
+    )
+    daemon_group.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=300.0,
+        help="Seconds between full rescans of the server (default 300).",
+    )
+    api_group = parser.add_argument_group(
+        "api", "Accept enrollment changes over a local HTTP API."
+    )
+    api_group.add_argument(
+        "--api",
+        type=int,
+        metavar="PORT",
+        help="Serve POST /events on 127.0.0.1:PORT and apply them with --template.",
+    )
+    api_group.add_argument(
+        "--coalesce-window",
+        type=float,
+        default=enrollment.COALESCE_WINDOW,
+        help="Seconds to collect events before applying them together (default 2).",
+    )
     args = parser.parse_args()
+    if args.daemon and not args.template:
+        parser.error("--template is required with --daemon")
+    if args.api is not None and not args.template:
+        parser.error("--template is required with --api")
+    if args.teardown and not (args.pattern or args.csv):
+        parser.error("--teardown requires --pattern and/or --csv")
+    if args.csv and not args.template and not args.teardown:
+        parser.error("--template is required with --csv")
+    if args.chunk_size and (not args.csv or args.teardown):
+        parser.error("--chunk-size only applies to --csv runs")
     setup_logger(logging.DEBUG if args.verbose else logging.INFO)
 
     logger.info(f"Log file location: {Path(LOG_FILE).absolute()}")
     logger.info(f"UNDO file location: {Path(UNDO_FILE).absolute()}")
+    if args.profile:
+        profiling.enable(Path(LOG_FILE).absolute().parent)
+
+    if args.record:
+        atexit.register(p4_utils.start_recording(args.record).close)
+        logger.info(f"Recording server traffic to {Path(args.record).absolute()}")
+    elif args.replay:
+        atexit.register(p4_utils.start_replay(args.replay, args.replay_speed).close)
+        logger.info(f"Replaying server traffic from {Path(args.replay).absolute()}")
 
     EMAIL_DOMAIN = read_config("EMAIL_DOMAIN", fallback=EMAIL_DOMAIN)
     DEFAULT_PASSWORD = read_config("DEFAULT_PASSWORD", fallback=DEFAULT_PASSWORD)
     REQUIRE_PASSWORD_RESET = read_config(
         "REQUIRE_PASSWORD_RESET", fallback=REQUIRE_PASSWORD_RESET, is_bool=True
     )
+    MAX_CONCURRENCY = int(read_config("MAX_CONCURRENCY", fallback=MAX_CONCURRENCY))
+    p4_utils.concurrency.MAX_CONCURRENCY = MAX_CONCURRENCY
+
+    shared_data = SharedData()
+    shared_data.default_password = DEFAULT_PASSWORD
+    shared_data.require_password_reset = REQUIRE_PASSWORD_RESET
+
+    if args.teardown:
+        try:
+            sys.exit(
+                run_teardown(
+                    args.pattern,
+                    args.csv,
+                    args.remove_users,
+                    args.max_rate,
+                    args.yes,
+                )
+            )
+        except p4_utils.P4Exception as e:
+            logger.error(f"Server error: {e}")
+            sys.exit(1)
+        finally:
+            p4_utils.disconnect()
+
+    if args.daemon:
+        try:
+            sys.exit(
+                run_daemon(
+                    shared_data,
+                    args.daemon,
+                    args.template,
+                    args.poll_interval,
+                    args.refresh_interval,
+                )
+            )
+        except p4_utils.P4Exception as e:
+            logger.error(f"Server error: {e}")
+            sys.exit(1)
+        finally:
+            p4_utils.disconnect()
+
+    if args.api is not None:
+        try:
+            sys.exit(
+                run_api(
+                    shared_data,
+                    args.api,
+                    args.template,
+                    args.coalesce_window,
+                    args.refresh_interval,
+                )
+            )
+        except p4_utils.P4Exception as e:
+            logger.error(f"Server error: {e}")
+            sys.exit(1)
+        finally:
+            p4_utils.disconnect()
+
+    if args.csv:
+        try:
+            sys.exit(
+                run_headless(shared_data, args.csv, args.template, args.chunk_size)
+            )
+        except p4_utils.P4Exception as e:
+            logger.error(f"Server error: {e}")
+            sys.exit(1)
+        finally:
+            p4_utils.disconnect()
 
     sys.excepthook = custom_exception_hook
     app = QApplication(sys.argv)
-    shared_data = SharedData()
     window = MainWindow(shared_data)
     window.show()
     sys.exit(app.exec())
@@ -1,8 +1,99 @@
+import threading
+
 from P4 import P4, P4Exception
 
-p4 = P4()
 
+class ConnectionProxy:
+    """Routes every call to a P4 connection owned by the calling thread.
+
+    The main thread uses the connection that `init` logs in. Any other thread
+    leases a connection from an idle pool (creating one with the same port,
+    user and credentials if needed) so that concurrent workers never share
+    `p4.input` or interleave commands on one socket.
+    """
+
+    def __init__(self, connection):
+        object.__setattr__(self, "_main", connection)
+        object.__setattr__(self, "_main_thread", threading.get_ident())
+        object.__setattr__(self, "_local", threading.local())
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "_idle", [])
+        object.__setattr__(self, "_all", [])
+        object.__setattr__(self, "_factory", P4)
+
+    def _connection(self):
+        if threading.get_ident() == self._main_thread:
+            return self._main
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = self._new_connection()
+                with self._lock:
+                    self._all.append(connection)
+            elif not connection.connected():
+                connection.connect()
+            self._local.connection = connection
+        return connection
+
+    def _new_connection(self):
+        connection = self._factory()
+        connection.port = self._main.port
+        connection.user = self._main.user
+        connection.client = self._main.client
+        connection.exception_level = self._main.exception_level
+        if self._main.password:
+            connection.password = self._main.password
+        connection.connect()
+        return connection
+
+    def release(self):
+        """Return the calling thread's connection to the idle pool."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        with self._lock:
+            self._idle.append(connection)
+
+    def use_transport(self, factory):
+        """Open every connection from now on with factory() instead of P4().
+
+        Used to record or replay server traffic; call before `init`.
+        """
+        self.disconnect_all()
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_main", factory())
+
+    def disconnect_all(self):
+        with self._lock:
+            connections = [self._main] + self._all
+            self._idle.clear()
+            self._all.clear()
+        for connection in connections:
+            if connection.connected():
+                connection.disconnect()
+
+    def __getattr__(self, name):
+        return getattr(self._connection(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection(), name, value)
+
+
+p4 = ConnectionProxy(P4())
+
+from .streaming import *
+from .batching import *
+from .stream_template import *
 from .functions import *
+from .concurrency import *
+from .verification import *
+from .teardown import *
+from .index import *
+from .catalog import *
+from .replay import *
 
 
 class P4PasswordException(P4Exception):
@@ -10,8 +101,18 @@ class P4PasswordException(P4Exception):
 
 
 def disconnect():
+    p4.disconnect_all()
+
+
+def release_connection():
+    p4.release()
+
+
+def reconnect():
+    """Drop and re-open the calling thread's connection."""
     if p4.connected():
         p4.disconnect()
+    p4.connect()
 
 
 def init(username=None, port=None, password=None):
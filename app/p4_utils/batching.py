@@ -0,0 +1,104 @@
+import logging
+
+from P4 import P4
+from p4_utils import p4, P4Exception
+from .streaming import stream_records
+
+__all__ = [
+    "chunks",
+    "run_batched",
+    "collect_batched",
+    "stream_sizes",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.batching")
+
+# Number of names/paths passed to a single multi-argument command.
+BATCH_SIZE = 500
+
+
+def chunks(arguments, size=None):
+    """Split arguments into lists of at most size (BATCH_SIZE) items."""
+    arguments = list(arguments)
+    size = size or BATCH_SIZE
+    return [arguments[i : i + size] for i in range(0, len(arguments), size)]
+
+
+def run_batched(command, flags, arguments, key):
+    """Run one command for many arguments and map the records back to each argument.
+
+    `p4 command *flags *chunk` runs once per chunk of BATCH_SIZE arguments.
+    key(record) returns the argument a result record belongs to. Arguments
+    that match nothing (e.g. names that do not exist, which the server
+    reports as warnings) get an empty list. A chunk that fails with an error
+    is split in half and retried, so only the arguments that really fail end
+    up in the errors.
+
+    Returns (results, errors): {argument: [records]} and {argument: P4Exception}.
+    """
+    results = {argument: [] for argument in arguments}
+    errors = {}
+
+    def run_chunk(chunk):
+        try:
+            # Missing names/paths come back as warnings; only real errors should raise.
+            with p4.at_exception_level(P4.RAISE_ERRORS):
+                records = p4.run(command, *flags, *chunk)
+        except P4Exception as e:
+            if len(chunk) == 1:
+                errors[chunk[0]] = e
+                return
+            middle = len(chunk) // 2
+            run_chunk(chunk[:middle])
+            run_chunk(chunk[middle:])
+            return
+        for record in records:
+            if isinstance(record, dict) and key(record) in results:
+                results[key(record)].append(record)
+
+    for chunk in chunks(arguments):
+        run_chunk(chunk)
+    if errors:
+        logger.debug(f"p4 {command} failed for {len(errors)} arguments: {errors}")
+    return results, errors
+
+
+def collect_batched(field, command, arguments) -> set:
+    """Values of one field from `p4 command` run over chunks of arguments.
+
+    Records are streamed rather than collected, for listings too large to
+    hold as dicts.
+    """
+    values = set()
+
+    def collect(record):
+        value = record.get(field)
+        if value is not None:
+            values.add(value)
+
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        for chunk in chunks(arguments):
+            stream_records(collect, command, *chunk)
+    return values
+
+
+def stream_sizes(streams):
+    """{stream: (file count, total size)} of each stream's head revisions.
+
+    Runs `p4 sizes -s` over `stream/...#head` for every stream name. Streams
+    that cannot be sized are logged and left out.
+    """
+    suffix = "/...#head"
+    paths = [f"{stream}{suffix}" for stream in streams]
+    results, errors = run_batched("sizes", ["-s"], paths, key=lambda r: r.get("path"))
+    for path, error in errors.items():
+        logger.warning(f"Unable to size {path}: {error}")
+    return {
+        path[: -len(suffix)]: (
+            sum(int(record.get("fileCount", 0)) for record in records),
+            sum(int(record.get("fileSize", 0)) for record in records),
+        )
+        for path, records in results.items()
+        if path not in errors
+    }
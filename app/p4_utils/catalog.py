@@ -0,0 +1,153 @@
+import json
+import logging
+import threading
+
+from P4 import P4
+from p4_utils import p4, P4Exception
+from .batching import stream_sizes
+from .stream_template import (
+    StreamTemplate,
+    get_stream_template,
+    get_template_streams,
+    stream_updates,
+)
+
+__all__ = [
+    "TemplateCatalog",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.catalog")
+
+
+def _latest_change(depot_name):
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        changes = p4.run("changes", "-m1", "-s", "submitted", f"//{depot_name}/...")
+    return int(changes[0]["change"]) if changes else 0
+
+
+class TemplateCatalog:
+    """Template depots with their stream tree and the cost of populating from them.
+
+    Each entry holds the template's stream specs (parents first), the file
+    count and size of every stream, and the totals one populated depot will
+    get. Entries are keyed to the template's latest submitted changelist and
+    the Update time of each of its streams (spec edits create no changelist),
+    and only rebuilt when either changes, so reloading is one `p4 changes -m1`
+    and one `p4 streams` per template. `refresh` with force=True rebuilds
+    everything. With cache_file, entries are kept on disk between runs (for
+    the same server only).
+    """
+
+    def __init__(self, cache_file=None, template_pattern="template"):
+        self.cache_file = cache_file
+        self.template_pattern = template_pattern
+        self.lock = threading.Lock()
+        self.entries = {}
+        if cache_file:
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    cache = json.load(f)
+                if cache.get("port") == p4.port:
+                    self.entries = cache["entries"]
+            except (OSError, ValueError, KeyError):
+                logger.debug(f"Ignoring unreadable template cache {cache_file}")
+
+    def get(self, depot_name):
+        """The cached entry for a template, or None if it is not loaded yet."""
+        with self.lock:
+            return self.entries.get(depot_name)
+
+    def stream_template(self, depot_name):
+        """A StreamTemplate for creating depots from depot_name.
+
+        The cached specs are only used if every stream's Update time still
+        matches the live `p4 streams` listing (the entry may come straight
+        from the on-disk cache); otherwise the specs are fetched again.
+        """
+        streams = get_template_streams(depot_name)
+        entry = self.get(depot_name)
+        if entry is None or entry.get("updates") != stream_updates(streams):
+            return get_stream_template(depot_name, streams)
+        return StreamTemplate(depot_name, entry["streams"])
+
+    def load_depots(self):
+        """List the template depots (names only; no per-template queries)."""
+        return p4.run("depots", "-E", f"*{self.template_pattern}*")
+
+    def load(self, depot, force=False):
+        """Return the entry for a template depot record, rebuilding it if it is out of date."""
+        depot_name = depot["name"]
+        change = _latest_change(depot_name)
+        streams = get_template_streams(depot_name)
+        updates = stream_updates(streams)
+        cached = self.get(depot_name)
+        if (
+            cached
+            and cached["change"] == change
+            and cached.get("updates") == updates
+            and not force
+        ):
+            return cached
+        template = get_stream_template(depot_name, streams)
+        sizes = stream_sizes(
+            stream["Stream"]
+            for stream in template.streams
+            if stream.get("Type") != "virtual"
+        )
+        entry = {
+            "name": depot_name,
+            "type": depot["type"],
+            "change": change,
+            "updates": updates,
+            "streams": template.streams,
+            "sizes": sizes,
+            "file_count": sum(count for count, _ in sizes.values()),
+            "file_size": sum(size for _, size in sizes.values()),
+        }
+        with self.lock:
+            self.entries[depot_name] = entry
+        logger.debug(
+            f"Template {depot_name} @{change}: {len(template.streams)} streams, "
+            f"{entry['file_count']} files, {entry['file_size']} bytes"
+        )
+        return entry
+
+    def cached_depots(self):
+        """Template depot records from the cache, before the server is asked."""
+        with self.lock:
+            return [
+                {"name": entry["name"], "type": entry["type"]}
+                for entry in sorted(self.entries.values(), key=lambda e: e["name"])
+            ]
+
+    def refresh(self, callback=None, depots_callback=None, force=False):
+        """Load (or validate) every template, calling callback(entry) as each is ready.
+
+        depots_callback(depots) is called first with the current template depots.
+        """
+        depots = self.load_depots()
+        if depots_callback:
+            depots_callback(depots)
+        for depot in depots:
+            try:
+                entry = self.load(depot, force=force)
+            except P4Exception as e:
+                logger.error(f"Unable to load template {depot['name']}: {e}")
+                continue
+            if callback:
+                callback(entry)
+        with self.lock:
+            names = {depot["name"] for depot in depots}
+            self.entries = {
+                name: entry for name, entry in self.entries.items() if name in names
+            }
+        self.save()
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            cache = {"port": p4.port, "entries": dict(self.entries)}
+        with open(self.cache_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f, default=str)
@@ -0,0 +1,316 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from P4 import P4
+import p4_utils
+from p4_utils import p4, P4Exception
+
+__all__ = [
+    "is_transient",
+    "is_disconnect",
+    "P4CancelledException",
+    "current_cancel_event",
+    "CancelHandler",
+    "cancellable",
+    "AdaptiveLimiter",
+    "RateLimiter",
+    "execute",
+    "run_parallel",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.concurrency")
+
+# Maximum number of operations in flight against the server at once.
+MAX_CONCURRENCY = 8
+
+# Errors that mean the server is under pressure (or the link dropped) and
+# the same command is likely to succeed if tried again a little later.
+TRANSIENT_ERRORS = [
+    "MaxCommands",
+    "MaxLockTime",
+    "Too many commands",
+    "too many concurrent",
+    "Operation took too long",
+    "database is locked",
+    "lock wait",
+    "TCP receive failed",
+    "TCP send failed",
+    "TCP receive exceeded maximum configured duration",
+    "Partner exited unexpectedly",
+    "Connect to server failed",
+    "Connection reset",
+    "Server is shutting down",
+]
+DISCONNECT_ERRORS = [
+    "TCP receive failed",
+    "TCP send failed",
+    "Partner exited unexpectedly",
+    "Connect to server failed",
+    "Connection reset",
+]
+
+
+def is_transient(error: P4Exception) -> bool:
+    message = str(error).lower()
+    return any(pattern.lower() in message for pattern in TRANSIENT_ERRORS)
+
+
+def is_disconnect(error: P4Exception) -> bool:
+    message = str(error).lower()
+    return any(pattern.lower() in message for pattern in DISCONNECT_ERRORS)
+
+
+class P4CancelledException(P4Exception):
+    pass
+
+
+_cancel_local = threading.local()
+
+
+def current_cancel_event():
+    """The event passed to the innermost `cancellable` on this thread, if any."""
+    return getattr(_cancel_local, "event", None)
+
+
+class CancelHandler(P4.OutputHandler):
+    """Passes output through until the event is set, then cancels the command."""
+
+    def __init__(self, cancel_event=None):
+        P4.OutputHandler.__init__(self)
+        self.cancel_event = cancel_event or current_cancel_event()
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def _check(self, output):
+        return self.CANCEL if self.cancelled() else self.REPORT
+
+    outputStat = _check
+    outputInfo = _check
+    outputText = _check
+    outputBinary = _check
+    outputMessage = _check
+
+
+@contextmanager
+def cancellable(cancel_event):
+    """Abort the calling thread's commands as soon as cancel_event is set.
+
+    Commands already running are cancelled at their next piece of output.
+    Raises P4CancelledException on entry or exit if the event is set, so
+    partial results are never mistaken for complete ones.
+    """
+    if cancel_event.is_set():
+        raise P4CancelledException("Cancelled")
+    previous_event = current_cancel_event()
+    _cancel_local.event = cancel_event
+    try:
+        with p4.using_handler(CancelHandler(cancel_event)):
+            yield
+    finally:
+        _cancel_local.event = previous_event
+    if cancel_event.is_set():
+        raise P4CancelledException("Cancelled")
+
+
+class AdaptiveLimiter:
+    """Caps concurrent server operations using additive-increase/multiplicative-decrease.
+
+    Every successful operation that finishes within `latency_tolerance` times
+    the best observed latency (or under `latency_floor` seconds) grows the
+    limit by roughly one slot per window.
+    A throttling error or a latency spike multiplies the limit by
+    `decrease_factor`, at most once per `cooldown` seconds so that a burst of
+    failures from one overloaded moment only backs off once.
+    """
+
+    def __init__(
+        self,
+        initial=2,
+        minimum=1,
+        maximum=None,
+        latency_tolerance=3.0,
+        latency_floor=0.05,
+        decrease_factor=0.5,
+        cooldown=1.0,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or MAX_CONCURRENCY)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.successes = 0
+        self.failures = 0
+        self.throttled = 0
+        self.retries = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, throttled=False, failed=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self._decrease()
+            elif failed:
+                self.failures += 1
+            else:
+                self.successes += 1
+                self._observe(latency)
+                if latency > max(
+                    self.baseline * self.latency_tolerance, self.latency_floor
+                ):
+                    self._decrease()
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def record_retry(self):
+        with self._condition:
+            self.retries += 1
+
+    def _observe(self, latency):
+        self.latency = (
+            latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        )
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Let the baseline drift up slowly so one lucky sample does not
+            # make every later operation look like a spike.
+            self.baseline = 0.99 * self.baseline + 0.01 * latency
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        logger.debug(
+            f"Server pressure detected, concurrency limit now {int(self.limit)}"
+        )
+
+    def metrics(self):
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "latency": round(self.latency, 3) if self.latency else None,
+                "successes": self.successes,
+                "failures": self.failures,
+                "throttled": self.throttled,
+                "retries": self.retries,
+            }
+
+
+class RateLimiter:
+    """Spaces calls out so that at most `rate` of them start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def execute(func, *args, limiter=None, retries=4, base_delay=0.5, max_delay=30.0):
+    """Run func(*args), retrying transient server errors with jittered backoff."""
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        start = time.monotonic()
+        try:
+            result = func(*args)
+        except P4Exception as e:
+            transient = is_transient(e)
+            if limiter:
+                limiter.release(
+                    time.monotonic() - start, throttled=transient, failed=not transient
+                )
+            if not transient or attempt >= retries:
+                raise e
+            attempt += 1
+            if limiter:
+                limiter.record_retry()
+            if is_disconnect(e) or not p4.connected():
+                try:
+                    p4_utils.reconnect()
+                except P4Exception as reconnect_error:
+                    logger.debug(f"Reconnect failed: {reconnect_error}")
+            # "Full jitter" backoff keeps retrying workers from stampeding together.
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            logger.warning(
+                f"Transient server error (attempt {attempt}/{retries}), retrying in {delay:.1f}s: {e}"
+            )
+            time.sleep(delay)
+        except Exception:
+            if limiter:
+                limiter.release(time.monotonic() - start, failed=True)
+            raise
+        else:
+            if limiter:
+                limiter.release(time.monotonic() - start)
+            return result
+
+
+def _run_task(func, item, limiter, retries):
+    try:
+        return execute(func, item, limiter=limiter, retries=retries)
+    finally:
+        p4_utils.release_connection()
+
+
+def run_parallel(func, items, progress_callback=None, limiter=None, retries=4):
+    """Apply func to every item concurrently under an adaptive concurrency limit.
+
+    Returns (results, errors): results in the same order as items (None for
+    failures) and a dict of item index to the exception that stopped it.
+    """
+    items = list(items)
+    limiter = limiter or AdaptiveLimiter()
+    results = [None] * len(items)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+        futures = {
+            executor.submit(_run_task, func, item, limiter, retries): i
+            for i, item in enumerate(items)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+            if progress_callback:
+                progress_callback.emit(done)
+            if done % 50 == 0:
+                logger.debug(f"Progress {done}/{len(items)}: {limiter.metrics()}")
+    logger.info(
+        f"{func.__name__}: {len(items) - len(errors)}/{len(items)} succeeded. "
+        f"Concurrency metrics: {limiter.metrics()}"
+    )
+    return results, errors
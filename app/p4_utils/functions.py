@@ -1,9 +1,36 @@
 import logging
 
-from p4_utils import p4, P4Exception
+from P4 import P4
+from p4_utils import p4
+from .streaming import collect_field
+from .stream_template import (
+    get_stream_template,
+    get_template_streams,
+    retarget_stream_name,
+)
+from .batching import collect_batched
 
 import logging
 
+__all__ = [
+    "check_remaining_seats",
+    "check_users",
+    "create_user",
+    "set_initial_password",
+    "require_password_reset",
+    "get_existing_group_names",
+    "create_group",
+    "check_depots",
+    "create_depot",
+    "get_streams",
+    "create_stream",
+    "has_files",
+    "populate_new_depot",
+    "check_permissions",
+    "create_permissions",
+    "get_template_depots",
+]
+
 # Create a custom logger
 logger = logging.getLogger("main.functions")
 
@@ -13,9 +40,13 @@ def check_remaining_seats():
     return int(license_info[0]["userLimit"]) - int(license_info[0]["userCount"])
 
 
-def check_users(new_user_list):
+def check_users(new_user_list, current_user_names=None):
     """Check if the users in user_list exist in the Perforce server."""
-    current_user_names = [user["User"] for user in p4.run("users")]
+    if current_user_names is None:
+        # Only ask about the roster's users rather than listing every user.
+        current_user_names = collect_batched(
+            "User", "users", sorted({user["User"] for user in new_user_list})
+        )
     users_to_add = [
         user for user in new_user_list if user["User"] not in current_user_names
     ]
@@ -36,37 +67,44 @@ def set_initial_password(user: str, password: str, require_reset: bool):
     p4.input = password
     result = p4.run("passwd", user)
     if require_reset:
-        result += p4.run("admin", "resetpassword", "-u", user)
+        result += require_password_reset(user)
     return result
 
 
-def get_existing_groups():
-    """Check if the groups in group_list exist in the Perforce server."""
-    current_groups = p4.run("groups")
-    current_group_names = {group["group"] for group in current_groups}
-    existing_groups_data = []
-    for group_name in current_group_names:
-        try:
-            existing_groups_data.append(p4.run_group("-o", group_name)[0])
-        except P4Exception as e:
-            logger.error(e)
-    return existing_groups_data
+def require_password_reset(user: str):
+    return p4.run("admin", "resetpassword", "-u", user)
+
+
+def get_existing_group_names():
+    """Names of all groups on the server."""
+    # Tagged `p4 groups` returns one record per membership; only keep the name.
+    return collect_field("group", "groups")
 
 
 def create_group(group_to_add: dict):
     group_spec = p4.run("group", "-o", group_to_add["Group"])[0]
-    group_spec.setdefault("Users", []).extend(group_to_add["Users"])
-    group_spec.setdefault("Owners", []).extend(group_to_add["Owners"])
+    # Skip existing members so re-applying a roster leaves the group unchanged.
+    for key in ("Users", "Owners"):
+        members = group_spec.setdefault(key, [])
+        new_members = [
+            user for user in dict.fromkeys(group_to_add[key]) if user not in members
+        ]
+        members.extend(new_members)
+    # Optional "Remove" list: users to take out of both Users and Owners.
+    removed = set(group_to_add.get("Remove", []))
+    if removed:
+        for key in ("Users", "Owners"):
+            group_spec[key] = [user for user in group_spec[key] if user not in removed]
     p4.input = group_spec
     return p4.run("group", "-i")
 
 
-def check_depots(new_group_list):
+def check_depots(new_group_list, current_depot_names=None):
     # Groups and Depots have the same name
     """Check if the depots in depot_list exist in the Perforce server."""
-    current_depots = p4.run("depots")
-    current_depot_names = [depot["name"] for depot in current_depots]
-    logger.debug(f"Current depots: {current_depot_names}")
+    if current_depot_names is None:
+        current_depot_names = collect_field("name", "depots")
+    logger.debug(f"Current depots: {len(current_depot_names)}")
     logger.debug(f"New depot names: {new_group_list}")
     depots_to_add = [
         depot for depot in new_group_list if depot not in current_depot_names
@@ -83,48 +121,12 @@ def create_depot(depot_name, depot_type):
 
 
 def get_streams(template_depot_name, new_depot_name):
-    exclude_keys = [
-        "Update",
-        "Access",
-        "baseParent",
-        "streamSpecDigest",
-        "firmerThanParent",
-    ]
-    streams = p4.run_streams(
-        "-F", f"Stream=//{template_depot_name}/... | Parent=//{template_depot_name}/..."
-    )
-    streams_details = [p4.run_stream("-o", stream["Stream"])[0] for stream in streams]
-    for stream in streams_details:
-        for key in exclude_keys:
-            stream.pop(key, None)
-        for key in stream:
-            if isinstance(stream[key], str):
-                stream[key] = stream[key].replace(template_depot_name, new_depot_name)
-            elif isinstance(stream[key], list):
-                stream[key] = [
-                    value.replace(template_depot_name, new_depot_name)
-                    for value in stream[key]
-                ]
-
-    # Function to get the parents in order
-    def get_parents(stream):
-        parents = []
-        while stream:
-            parents.insert(0, stream["Stream"])
-            stream = next(
-                (
-                    item
-                    for item in streams_details
-                    if item["Stream"] == stream["Parent"]
-                ),
-                None,
-            )
-        return parents
+    """The template depot's stream specs retargeted to new_depot_name, parents first.
 
-    # Sorting the list
-    sorted_list = sorted(streams_details, key=lambda x: get_parents(x))
-
-    return sorted_list
+    Fetches the template on every call; when creating many depots, call
+    get_stream_template once and use its for_depot instead.
+    """
+    return get_stream_template(template_depot_name).for_depot(new_depot_name)
 
 
 def create_stream(stream_to_add: dict):
@@ -132,40 +134,60 @@ def create_stream(stream_to_add: dict):
     return p4.run("stream", "-i")
 
 
-def create_branch_maps(template_depot_name, new_depot_name):
-    streams = p4.run_streams(
-        "-F", f"Stream=//{template_depot_name}/... | Parent=//{template_depot_name}/..."
-    )
-    branch_maps = []
-    for stream in streams:
+def has_files(stream):
+    """Whether the stream holds any files at all."""
+    # An empty path comes back as a warning, not an error.
+    with p4.at_exception_level(P4.RAISE_ERRORS):
+        return bool(p4.run("files", "-m1", f"{stream}/..."))
+
+
+def populate_new_depot(
+    template_depot_name,
+    new_depot_name,
+    template_streams=None,
+    populated=None,
+    check_head=False,
+):
+    """Copy the head revisions of every template stream into the new depot.
+
+    template_streams: the template's `p4 streams` records, if already fetched.
+    Each stream is populated straight from its template path, with one
+    `p4 populate` per stream and no temporary branch specs.
+    populated: a set of target streams that are already filled. Each stream
+        is added as it finishes and skipped if it is in the set, so passing
+        the same set to a retry carries on where the last attempt stopped.
+    check_head: skip target streams that already hold files, for retries
+        after an error that may have hidden a populate the server finished.
+    """
+    logger.debug(f"Populating with initial template for {new_depot_name}...")
+    if template_streams is None:
+        template_streams = get_template_streams(template_depot_name)
+    if populated is None:
+        populated = set()
+    for stream in template_streams:
         if stream["Type"] == "virtual":
             continue
-        branch_map = p4.fetch_branch(f"populate_{new_depot_name}_{stream['Stream']}")
-        branch_map["View"] = [
-            f"{stream['Stream']}/... {stream['Stream'].replace(template_depot_name, new_depot_name)}/..."
-        ]
-        logger.debug(branch_map)
-        p4.save_branch(branch_map)
-        branch_maps.append(branch_map["Branch"])
-    return branch_maps
-
-
-def populate_new_depot(template_depot_name, new_depot_name):
-    logger.debug(f"Populating with initial template for {new_depot_name}...")
-    branch_maps = create_branch_maps(template_depot_name, new_depot_name)
-    for branch_map in branch_maps:
-        p4.run_populate(
-            "-d",
-            f"Populating with initial template for {new_depot_name}",
-            "-b",
-            branch_map,
+        target = retarget_stream_name(
+            stream["Stream"], template_depot_name, new_depot_name
         )
-        p4.run_branch("-d", branch_map)
+        if target in populated:
+            continue
+        if check_head and has_files(target):
+            logger.debug(f"{target} is already populated, skipping it.")
+        else:
+            p4.run_populate(
+                "-d",
+                f"Populating with initial template for {new_depot_name}",
+                f"{stream['Stream']}/...",
+                f"{target}/...",
+            )
+        populated.add(target)
 
 
-def check_permissions(new_group_list):
+def check_permissions(new_group_list, current_permissions=None):
     """Check if the permissions in permission_list exist in the Perforce server."""
-    current_permissions = p4.run("protect", "-o")[0]["Protections"]
+    if current_permissions is None:
+        current_permissions = set(p4.run("protect", "-o")[0]["Protections"])
     new_permissions = [
         f"write group {group_name} * //{group_name}/..."
         for group_name in new_group_list
@@ -181,6 +203,13 @@ def check_permissions(new_group_list):
 
 def create_permissions(permissions_to_add):
     protect_table = p4.run("protect", "-o")[0]
+    # A retry after a lost reply may find the lines already written.
+    current_permissions = set(protect_table["Protections"])
+    permissions_to_add = [
+        line for line in permissions_to_add if line not in current_permissions
+    ]
+    if not permissions_to_add:
+        return []
     protect_table["Protections"] = permissions_to_add + protect_table["Protections"]
     p4.input = protect_table
     return p4.run("protect", "-i")
@@ -0,0 +1,70 @@
+import logging
+import time
+
+from P4 import P4
+from p4_utils import p4
+from .batching import collect_batched
+from .streaming import collect_field
+
+__all__ = [
+    "ServerIndex",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.index")
+
+
+class ServerIndex:
+    """In-memory copy of the names the planner checks against.
+
+    Lets a long-running process plan new rosters without rescanning every
+    user, group and depot on the server each time. Call `add` after applying
+    a plan so the index stays current between full refreshes.
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.groups = set()
+        self.depots = set()
+        self.protections = set()
+        self.refreshed_at = None
+
+    def refresh(self):
+        start = time.monotonic()
+        self.users = collect_field("User", "users")
+        self.groups = collect_field("group", "groups")
+        self.depots = collect_field("name", "depots")
+        self.protections = set(p4.run("protect", "-o")[0]["Protections"])
+        self.refreshed_at = time.monotonic()
+        logger.info(
+            f"Server index refreshed in {self.refreshed_at - start:.1f}s: "
+            f"{len(self.users)} users, {len(self.groups)} groups, {len(self.depots)} depots"
+        )
+
+    def age(self):
+        if self.refreshed_at is None:
+            return float("inf")
+        return time.monotonic() - self.refreshed_at
+
+    def recheck(self, users=(), groups=(), depots=()):
+        """Ask the server about the given names that the index does not have.
+
+        Objects created outside this process since the last refresh are then
+        added, so a plan made from the index never tries to create them again.
+        Names already in the index are not queried.
+        """
+        self.users |= collect_batched("User", "users", sorted(set(users) - self.users))
+        # `p4 groups` and `p4 depots` take one name at a time.
+        with p4.at_exception_level(P4.RAISE_ERRORS):
+            for group in sorted(set(groups) - self.groups):
+                if group in collect_field("group", "groups", "-v", group):
+                    self.groups.add(group)
+            for depot in sorted(set(depots) - self.depots):
+                if depot in collect_field("name", "depots", "-e", depot):
+                    self.depots.add(depot)
+
+    def add(self, users=(), groups=(), depots=(), protections=()):
+        self.users.update(users)
+        self.groups.update(groups)
+        self.depots.update(depots)
+        self.protections.update(protections)
@@ -0,0 +1,269 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from P4 import P4
+from p4_utils import p4, P4Exception
+
+__all__ = [
+    "TraceRecorder",
+    "TraceReplayer",
+    "RecordingP4",
+    "ReplayP4",
+    "start_recording",
+    "start_replay",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.replay")
+
+# Inputs to these commands are passwords, so they are never written to a trace.
+REDACTED_COMMANDS = ["login", "passwd"]
+
+
+def _trace_key(args):
+    return json.dumps([str(arg) for arg in args])
+
+
+def _trace_input(args, value):
+    if value is None or value == "":
+        return None
+    if args and args[0] in REDACTED_COMMANDS:
+        return "<redacted>"
+    return value
+
+
+class _TeeHandler(P4.OutputHandler):
+    """Records every tagged record the server sends before passing it on."""
+
+    def __init__(self, handler, records):
+        P4.OutputHandler.__init__(self)
+        self.handler = handler
+        self.records = records
+
+    def outputStat(self, stat):
+        self.records.append(stat)
+        return self.handler.outputStat(stat)
+
+    def outputInfo(self, info):
+        return self.handler.outputInfo(info)
+
+    def outputText(self, text):
+        return self.handler.outputText(text)
+
+    def outputBinary(self, binary):
+        return self.handler.outputBinary(binary)
+
+    def outputMessage(self, message):
+        return self.handler.outputMessage(message)
+
+
+class TraceRecorder:
+    """Writes every command run through the connection proxy to a trace file.
+
+    Each line of the file is one command: its arguments, input spec, tagged
+    results (or error), latency and start time relative to the recording.
+    """
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.file = open(trace_file, "w", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.count = 0
+        self.server_time = 0.0
+
+    def connection(self):
+        return RecordingP4(self)
+
+    def write(self, args, command_input, results, error, start, latency):
+        entry = {
+            "thread": threading.current_thread().name,
+            "start": round(start - self.started, 6),
+            "latency": round(latency, 6),
+            "args": [str(arg) for arg in args],
+            "input": command_input,
+            "results": results,
+            "error": error,
+        }
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.count += 1
+            self.server_time += latency
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+        logger.info(
+            f"Recorded {self.count} commands ({self.server_time:.1f}s of server time) "
+            f"to {self.trace_file}"
+        )
+
+
+class TraceReplayer:
+    """Answers commands from a recorded trace instead of a server.
+
+    Commands are matched by their arguments (and input, when several recorded
+    commands share the same arguments), so the order may differ from the
+    recording, e.g. because of parallel workers. Each answer waits for the
+    recorded latency divided by `speed`; a speed of 0 replays without waiting.
+    Commands not in the trace raise a P4Exception.
+    """
+
+    def __init__(self, trace_file, speed=1.0):
+        self.trace_file = trace_file
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.recorded_count = 0
+        self.recorded_span = 0.0
+        with open(trace_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.entries.setdefault(_trace_key(entry["args"]), deque()).append(
+                    entry
+                )
+                self.recorded_count += 1
+                self.recorded_span = max(
+                    self.recorded_span, entry["start"] + entry["latency"]
+                )
+        self.started = time.monotonic()
+        self.count = 0
+        self.unmatched = []
+        self.server_time = 0.0
+
+    def next_entry(self, args, command_input):
+        with self.lock:
+            queue = self.entries.get(_trace_key(args))
+            if not queue:
+                self.unmatched.append(" ".join(str(arg) for arg in args))
+                return None
+            entry = next(
+                (
+                    entry
+                    for entry in queue
+                    if command_input is not None and entry["input"] == command_input
+                ),
+                queue[0],
+            )
+            queue.remove(entry)
+            self.count += 1
+            self.server_time += entry["latency"]
+            return entry
+
+    def connection(self):
+        return ReplayP4(self)
+
+    def close(self):
+        leftover = sum(len(queue) for queue in self.entries.values())
+        logger.info(
+            f"Replayed {self.count} of {self.recorded_count} recorded commands in "
+            f"{time.monotonic() - self.started:.1f}s (recorded run: {self.recorded_span:.1f}s, "
+            f"{self.server_time:.1f}s of recorded server time). "
+            f"{leftover} recorded commands were never run, "
+            f"{len(self.unmatched)} commands were not in the trace."
+        )
+        if self.unmatched:
+            logger.info(f"Commands not in the trace: {self.unmatched}")
+
+
+class RecordingP4(P4):
+    """A real connection that hands every command it runs to a TraceRecorder."""
+
+    def __init__(self, recorder):
+        P4.__init__(self)
+        self.recorder = recorder
+
+    def run(self, *args, **kargs):
+        command_input = _trace_input(args, getattr(self, "input", None))
+        handler = self.handler
+        records = []
+        if handler is not None:
+            self.handler = _TeeHandler(handler, records)
+        start = time.monotonic()
+        error = None
+        try:
+            results = P4.run(self, *args, **kargs)
+            if handler is None:
+                records = results
+            return results
+        except P4Exception as e:
+            error = {
+                "message": str(e),
+                "errors": list(getattr(e, "errors", []) or []),
+                "warnings": list(getattr(e, "warnings", []) or []),
+            }
+            raise e
+        finally:
+            if handler is not None:
+                self.handler = handler
+            self.recorder.write(
+                args, command_input, records, error, start, time.monotonic() - start
+            )
+
+
+class ReplayP4(P4):
+    """A connection that never touches a server and answers from a TraceReplayer."""
+
+    def __init__(self, replayer):
+        P4.__init__(self)
+        self.replayer = replayer
+        self.replay_connected = False
+
+    def connect(self):
+        self.replay_connected = True
+        return self
+
+    def connected(self):
+        return self.replay_connected
+
+    def disconnect(self):
+        self.replay_connected = False
+
+    def run(self, *args, **kargs):
+        args = [str(arg) for arg in args]
+        command_input = _trace_input(args, getattr(self, "input", None))
+        entry = self.replayer.next_entry(args, command_input)
+        if entry is None:
+            raise P4Exception(
+                f"p4 {' '.join(args)} is not in trace {self.replayer.trace_file}"
+            )
+        if self.replayer.speed:
+            time.sleep(entry["latency"] / self.replayer.speed)
+        error = entry["error"]
+        if error:
+            raise P4Exception((error["message"], error["errors"], error["warnings"]))
+        if self.handler is None:
+            return entry["results"]
+        results = []
+        for record in entry["results"]:
+            if isinstance(record, dict):
+                outcome = self.handler.outputStat(record)
+            else:
+                outcome = self.handler.outputInfo(record)
+            if outcome == P4.OutputHandler.CANCEL:
+                break
+            if outcome == P4.OutputHandler.REPORT:
+                results.append(record)
+        return results
+
+
+def start_recording(trace_file):
+    """Record every command from here on to trace_file. Call before init()."""
+    recorder = TraceRecorder(trace_file)
+    p4.use_transport(recorder.connection)
+    return recorder
+
+
+def start_replay(trace_file, speed=1.0):
+    """Answer every command from here on from trace_file. Call before init()."""
+    replayer = TraceReplayer(trace_file, speed)
+    p4.use_transport(replayer.connection)
+    return replayer
@@ -0,0 +1,120 @@
+import logging
+import re
+
+from p4_utils import p4
+
+__all__ = [
+    "retarget_stream_name",
+    "StreamTemplate",
+    "get_template_streams",
+    "stream_updates",
+    "get_stream_template",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.stream_template")
+
+# Stream spec fields that can hold depot paths. Everything else (Name, Owner,
+# Description, Options...) is copied from the template unchanged.
+STREAM_PATH_FIELDS = ["Stream", "Parent", "Paths", "Remapped", "Ignored"]
+# Read-only or server-computed fields that must not be sent back with `stream -i`.
+STREAM_EXCLUDE_FIELDS = [
+    "Update",
+    "Access",
+    "baseParent",
+    "streamSpecDigest",
+    "firmerThanParent",
+]
+
+
+def retarget_stream_name(stream_name, template_depot_name, new_depot_name):
+    """//template/name -> //new_depot/name for a stream of the template depot."""
+    prefix = f"//{template_depot_name}/"
+    if not stream_name.startswith(prefix):
+        return stream_name
+    return f"//{new_depot_name}/{stream_name[len(prefix):]}"
+
+
+class StreamTemplate:
+    """A template depot's stream specs, parsed once and retargeted per depot.
+
+    Every value of a path field is split around the `//template/` tokens it
+    contains (only at the start of a path, so depots whose names merely
+    contain the template name are left alone). Retargeting a spec to a new
+    depot is then one join of those pieces per value.
+    """
+
+    def __init__(self, template_depot_name, stream_specs):
+        self.template_depot_name = template_depot_name
+        self.token = re.compile(
+            rf'(?:^|(?<=[\s"-]))//{re.escape(template_depot_name)}(?=/)'
+        )
+        # The template's own specs, parents first.
+        self.streams = _parents_first(stream_specs)
+        self.specs = []
+        for spec in self.streams:
+            fixed = {}
+            parsed = {}
+            for key, value in spec.items():
+                if key in STREAM_EXCLUDE_FIELDS:
+                    continue
+                if key not in STREAM_PATH_FIELDS:
+                    fixed[key] = value
+                elif isinstance(value, list):
+                    parsed[key] = (True, [self.token.split(line) for line in value])
+                else:
+                    parsed[key] = (False, self.token.split(value))
+            self.specs.append((fixed, parsed))
+
+    def for_depot(self, new_depot_name):
+        """The template's stream specs for new_depot_name, parents first."""
+        depot = f"//{new_depot_name}"
+        streams = []
+        for fixed, parsed in self.specs:
+            stream = dict(fixed)
+            for key, (is_list, pieces) in parsed.items():
+                if is_list:
+                    stream[key] = [depot.join(line) for line in pieces]
+                else:
+                    stream[key] = depot.join(pieces)
+            streams.append(stream)
+        return streams
+
+
+def _parents_first(stream_specs):
+    streams_by_name = {spec["Stream"]: spec for spec in stream_specs}
+
+    def ancestry(spec):
+        names = []
+        while spec:
+            names.insert(0, spec["Stream"])
+            spec = streams_by_name.get(spec.get("Parent"))
+        return names
+
+    return sorted(stream_specs, key=ancestry)
+
+
+def get_template_streams(template_depot_name):
+    """The template depot's `p4 streams` records."""
+    return p4.run_streams(
+        "-F", f"Stream=//{template_depot_name}/... | Parent=//{template_depot_name}/..."
+    )
+
+
+def stream_updates(streams):
+    """{stream: Update time} for `p4 streams` records, to tell when a spec changed."""
+    return {stream["Stream"]: stream.get("Update") for stream in streams}
+
+
+def get_stream_template(template_depot_name, streams=None):
+    """Fetch every stream spec of the template depot and parse it once.
+
+    streams: the template's `p4 streams` records, if already fetched.
+    """
+    if streams is None:
+        streams = get_template_streams(template_depot_name)
+    stream_specs = [p4.run_stream("-o", stream["Stream"])[0] for stream in streams]
+    logger.debug(
+        f"Parsed {len(stream_specs)} streams of template depot {template_depot_name}"
+    )
+    return StreamTemplate(template_depot_name, stream_specs)
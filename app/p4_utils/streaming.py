@@ -0,0 +1,56 @@
+import logging
+
+from p4_utils import p4
+from .concurrency import CancelHandler
+
+__all__ = [
+    "RecordHandler",
+    "stream_records",
+    "collect_field",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.streaming")
+
+
+class RecordHandler(CancelHandler):
+    """Hands each tagged record to a callback instead of building a result list.
+
+    Large listings (`p4 users`, `p4 groups`, `p4 depots`) then never exist
+    as one list of dicts; callers keep only the fields they need. Still
+    honours the cancel event of an enclosing `cancellable`.
+    """
+
+    def __init__(self, callback):
+        CancelHandler.__init__(self)
+        self.callback = callback
+        self.count = 0
+
+    def outputStat(self, stat):
+        if self.cancelled():
+            return self.CANCEL
+        self.count += 1
+        self.callback(stat)
+        return self.HANDLED
+
+
+def stream_records(callback, *args):
+    """Run a tagged command, calling callback(record) as each record arrives."""
+    handler = RecordHandler(callback)
+    with p4.using_handler(handler):
+        p4.run(*args)
+    logger.debug(f"Streamed {handler.count} records from p4 {' '.join(args)}")
+    return handler.count
+
+
+def collect_field(field, *args) -> set:
+    """Run a tagged command and return the set of values of one field."""
+    values = set()
+
+    def collect(record):
+        value = record.get(field)
+        if value is not None:
+            values.add(value)
+
+    stream_records(collect, *args)
+    return values
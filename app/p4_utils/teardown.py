@@ -0,0 +1,226 @@
+import logging
+import shlex
+from fnmatch import fnmatchcase
+
+from p4_utils import p4, P4Exception
+from .batching import collect_batched, run_batched
+from .concurrency import execute, run_parallel
+from .streaming import stream_records
+
+__all__ = [
+    "plan_teardown",
+    "remove_protections",
+    "obliterate_depot",
+    "delete_group",
+    "delete_user",
+    "run_teardown",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.teardown")
+
+# Only depots of these types are ever selected for teardown.
+TEARDOWN_DEPOT_TYPES = ["stream", "local"]
+
+
+def _stream_depth(stream, streams_by_name):
+    depth = 0
+    parent = stream.get("Parent")
+    while parent in streams_by_name:
+        depth += 1
+        parent = streams_by_name[parent].get("Parent")
+    return depth
+
+
+def _protection_matches(line, groups, depots, users=()):
+    try:
+        fields = shlex.split(line)
+    except ValueError:
+        return False
+    if len(fields) < 5:
+        return False
+    _, kind, name, _, path = fields[:5]
+    if kind == "group" and name in groups:
+        return True
+    if kind == "user" and name in users:
+        return True
+    path = path.lstrip("-")
+    return any(path.startswith(f"//{depot_name}/") for depot_name in depots)
+
+
+def plan_teardown(
+    depot_pattern=None, group_names=(), user_names=(), remove_users=False
+):
+    """Select what to remove and order it so nothing is deleted before its dependents.
+
+    depot_pattern: glob (e.g. "202230_*") matched against depot and group names.
+    group_names/user_names: exact names, e.g. from a past roster CSV. Depots
+        with the same name as a selected group are selected too.
+    remove_users: also delete the named users and, with a pattern, users in
+        the selected groups. Only users whose every group membership is being
+        removed are selected.
+    """
+    current_depots = {}
+
+    def add_depot(result):
+        current_depots[result["name"]] = result["type"]
+
+    stream_records(add_depot, "depots")
+    memberships = {}
+    current_groups = set()
+
+    def add_membership(result):
+        current_groups.add(result["group"])
+        if result.get("isUser") == "1":
+            memberships.setdefault(result["user"], set()).add(result["group"])
+
+    stream_records(add_membership, "groups")
+
+    def selected(name):
+        return name in group_names or (
+            depot_pattern is not None and fnmatchcase(name, depot_pattern)
+        )
+
+    depots = sorted(
+        name
+        for name, depot_type in current_depots.items()
+        if selected(name)
+        and depot_type in TEARDOWN_DEPOT_TYPES
+        and "template" not in name.lower()
+    )
+    # Template groups go with the template depots, which are never removed.
+    groups = sorted(
+        group
+        for group in current_groups
+        if selected(group) and "template" not in group.lower()
+    )
+
+    streams = {}
+    if depots:
+        streams_by_path, errors = run_batched(
+            "streams",
+            [],
+            [f"//{name}/..." for name in depots],
+            key=lambda stream: "/".join(stream["Stream"].split("/")[:3]) + "/...",
+        )
+        for path, error in errors.items():
+            logger.error(f"Unable to list streams in {path}, skipping it: {error}")
+        depots = [name for name in depots if f"//{name}/..." not in errors]
+        depot_streams = [
+            stream for records in streams_by_path.values() for stream in records
+        ]
+        streams_by_name = {stream["Stream"]: stream for stream in depot_streams}
+        # Children must be obliterated before their parents.
+        for stream in sorted(
+            depot_streams,
+            key=lambda s: _stream_depth(s, streams_by_name),
+            reverse=True,
+        ):
+            depot_name = stream["Stream"].split("/")[2]
+            streams.setdefault(depot_name, []).append(stream["Stream"])
+
+    users = []
+    if remove_users:
+        removed_groups = set(groups)
+        candidates = set(user_names)
+        if depot_pattern is not None:
+            candidates |= set(memberships)
+        # Keep anyone who is still in a group that is not being removed.
+        candidates = sorted(
+            user
+            for user in candidates
+            if memberships.get(user, set()) <= removed_groups
+        )
+        # Names that no longer exist come back as warnings, not errors.
+        existing_users = collect_batched("User", "users", candidates)
+        # Never delete the account running the teardown.
+        users = sorted(existing_users - {p4.user})
+
+    protect_table = p4.run("protect", "-o")[0]
+    protections = [
+        line
+        for line in protect_table["Protections"]
+        if _protection_matches(line, set(groups), depots, set(users))
+    ]
+
+    plan = {
+        "protections": protections,
+        "streams": streams,
+        "depots": depots,
+        "groups": groups,
+        "users": users,
+    }
+    logger.debug(f"Teardown plan: {plan}")
+    return plan
+
+
+def remove_protections(protections_to_remove):
+    """Drop every given line from the protections table in one write."""
+    protections_to_remove = set(protections_to_remove)
+    protect_table = p4.run("protect", "-o")[0]
+    protect_table["Protections"] = [
+        line
+        for line in protect_table["Protections"]
+        if line not in protections_to_remove
+    ]
+    p4.input = protect_table
+    return p4.run("protect", "-i")
+
+
+def obliterate_depot(depot_name, streams, rate_limiter=None):
+    for stream in streams:
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            p4.run("stream", "--obliterate", "-y", stream)
+        except P4Exception as e:
+            # Already gone, e.g. when a transient error made us retry the depot.
+            if "doesn't exist" not in str(e) and "no such" not in str(e).lower():
+                raise e
+    if rate_limiter:
+        rate_limiter.acquire()
+    p4.run("obliterate", "-y", f"//{depot_name}/...")
+    p4.run("depot", "-d", depot_name)
+
+
+def delete_group(group_name):
+    return p4.run("group", "-dF", group_name)
+
+
+def delete_user(user_name):
+    return p4.run("user", "-df", user_name)
+
+
+def run_teardown(plan, progress_callback=None, rate_limiter=None):
+    """Apply a plan from plan_teardown and return {step: {name: error}} for failures."""
+    failures = {}
+
+    if plan["protections"]:
+        logger.info(f"Removing {len(plan['protections'])} protections lines...")
+        try:
+            execute(remove_protections, plan["protections"])
+        except P4Exception as e:
+            logger.error(f"Error removing protections: {e}")
+            failures["protections"] = {"protect": e}
+            # Deleting groups still referenced by protections would leave the
+            # table inconsistent, so stop here.
+            return failures
+
+    def obliterate_depot_task(depot_name):
+        obliterate_depot(depot_name, plan["streams"].get(depot_name, []), rate_limiter)
+
+    steps = [
+        ("depots", obliterate_depot_task, plan["depots"]),
+        ("groups", delete_group, plan["groups"]),
+        ("users", delete_user, plan["users"]),
+    ]
+    for step, func, names in steps:
+        if not names:
+            continue
+        logger.info(f"Removing {len(names)} {step}...")
+        _, errors = run_parallel(func, names, progress_callback)
+        if errors:
+            failures[step] = {names[i]: error for i, error in errors.items()}
+            for i, error in errors.items():
+                logger.error(f"Error removing {step[:-1]} {names[i]}: {error}")
+    return failures
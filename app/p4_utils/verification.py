@@ -0,0 +1,264 @@
+import logging
+from datetime import datetime
+
+from P4 import P4
+from p4_utils import p4
+from .batching import chunks, stream_sizes
+from .stream_template import retarget_stream_name
+from .streaming import collect_field, stream_records
+
+__all__ = [
+    "fetch_listings",
+    "verify_run",
+    "merge_verify_reports",
+]
+
+# Create a custom logger
+logger = logging.getLogger("main.verification")
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def run(self, *args):
+        self.count += 1
+        # Missing names/paths come back as warnings; only real errors should raise.
+        with p4.at_exception_level(P4.RAISE_ERRORS):
+            return p4.run(*args)
+
+    def collect_chunked(self, field, command, arguments):
+        values = set()
+        for chunk in chunks(arguments):
+            self.count += 1
+            with p4.at_exception_level(P4.RAISE_ERRORS):
+                values |= collect_field(field, command, *chunk)
+        return values
+
+    def collect(self, field, *args):
+        self.count += 1
+        return collect_field(field, *args)
+
+    def stream(self, callback, *args):
+        self.count += 1
+        stream_records(callback, *args)
+
+    def stream_sizes(self, streams):
+        streams = list(streams)
+        self.count += len(chunks(streams))
+        return stream_sizes(streams)
+
+
+def _size_report(sizes):
+    """(file count, total size) as report fields, or None if it is unknown."""
+    if sizes is None:
+        return None
+    return {"fileCount": sizes[0], "fileSize": sizes[1]}
+
+
+def fetch_listings(template_depot_name=None):
+    """Fetch the server-wide listings that verify_run compares against.
+
+    Pass the result to several verify_run calls for parts of one run (e.g.
+    the slices of a very large roster) so that each call does not list every
+    group membership, protections line, depot and template stream again.
+    """
+    return _fetch_listings(_QueryCounter(), template_depot_name)
+
+
+def _fetch_listings(queries, template_depot_name):
+    # Tagged `p4 groups` returns one record per membership, so a single call
+    # covers every group's users and owners.
+    members = {}
+
+    def add_membership(result):
+        group_members = members.setdefault(
+            result["group"], {"Users": set(), "Owners": set()}
+        )
+        if result.get("isUser") == "1":
+            group_members["Users"].add(result["user"])
+        if result.get("isOwner") == "1":
+            group_members["Owners"].add(result["user"])
+
+    queries.stream(add_membership, "groups")
+    listings = {
+        "members": members,
+        "protections": set(queries.run("protect", "-o")[0]["Protections"]),
+        "depots": queries.collect("name", "depots"),
+        "template_streams": [],
+        # Sized on first use, by the first call that checks populated depots.
+        "template_sizes": None,
+    }
+    if template_depot_name:
+        template_prefix = f"//{template_depot_name}/"
+        listings["template_streams"] = [
+            stream
+            for stream in queries.run("streams", f"{template_prefix}...")
+            if stream["Stream"].startswith(template_prefix)
+        ]
+    listings["queries"] = queries.count
+    return listings
+
+
+def verify_run(
+    users,
+    group_members,
+    depots,
+    template_depot_name=None,
+    populated_depots=None,
+    listings=None,
+):
+    """Check that a run's planned objects exist on the server.
+
+    users: usernames that should exist.
+    group_members: {group: {"Users": [...], "Owners": [...]}} that should be set.
+    depots: depots that should exist, each with a protections line for the
+        group of the same name and, with template_depot_name, the template's
+        streams.
+    populated_depots: depots whose streams should also hold the same file
+        count and size as the template's.
+    listings: fetch_listings(template_depot_name) to reuse instead of
+        listing the server again. Its queries are not counted in the report.
+
+    Uses a handful of bulk queries regardless of the number of objects and
+    returns a JSON-serializable report.
+    """
+    queries = _QueryCounter()
+    report = {"checked_at": datetime.now().isoformat(timespec="seconds")}
+    if listings is None:
+        listings = _fetch_listings(queries, template_depot_name)
+
+    # ____________USERS____________
+    users = sorted(set(users))
+    existing_users = queries.collect_chunked("User", "users", users)
+    report["users"] = {
+        "expected": len(users),
+        "missing": [user for user in users if user not in existing_users],
+    }
+
+    # ____________GROUPS____________
+    current_members = listings["members"]
+    missing_groups = []
+    missing_members = {}
+    for group, members in group_members.items():
+        if group not in current_members:
+            missing_groups.append(group)
+            continue
+        missing = {
+            key: [
+                user for user in members[key] if user not in current_members[group][key]
+            ]
+            for key in ("Users", "Owners")
+        }
+        if missing["Users"] or missing["Owners"]:
+            missing_members[group] = missing
+    report["groups"] = {
+        "expected": len(group_members),
+        "missing": missing_groups,
+        "missing_members": missing_members,
+    }
+
+    # _________PERMISSIONS__________
+    current_permissions = listings["protections"]
+    expected_permissions = [
+        f"write group {depot_name} * //{depot_name}/..." for depot_name in depots
+    ]
+    report["protections"] = {
+        "expected": len(expected_permissions),
+        "missing": [
+            line for line in expected_permissions if line not in current_permissions
+        ],
+    }
+
+    # _________DEPOTS__________
+    current_depots = listings["depots"]
+    report["depots"] = {
+        "expected": len(depots),
+        "missing": [depot for depot in depots if depot not in current_depots],
+    }
+
+    # _________STREAMS AND FILES__________
+    report["streams"] = {"expected": 0, "missing": []}
+    report["files"] = {"checked": 0, "mismatched": {}}
+    if template_depot_name and depots:
+        template_streams = listings["template_streams"]
+        # Every depot should have the template's streams, populated or not.
+        expected_streams = {}
+        for depot_name in depots:
+            for stream in template_streams:
+                name = retarget_stream_name(
+                    stream["Stream"], template_depot_name, depot_name
+                )
+                expected_streams[name] = (depot_name, stream)
+        current_streams = queries.collect_chunked(
+            "Stream", "streams", [f"//{depot_name}/..." for depot_name in depots]
+        )
+        report["streams"] = {
+            "expected": len(expected_streams),
+            "missing": [s for s in expected_streams if s not in current_streams],
+        }
+
+        if populated_depots:
+            populated_depots = set(populated_depots)
+            # Virtual streams never hold files, so only compare the others.
+            if listings["template_sizes"] is None:
+                listings["template_sizes"] = queries.stream_sizes(
+                    s["Stream"] for s in template_streams if s["Type"] != "virtual"
+                )
+            template_sizes = listings["template_sizes"]
+            populated_streams = [
+                name
+                for name, (depot_name, stream) in expected_streams.items()
+                if depot_name in populated_depots
+                and stream["Type"] != "virtual"
+                and name in current_streams
+            ]
+            populated_sizes = queries.stream_sizes(populated_streams)
+            for name in populated_streams:
+                template_stream = expected_streams[name][1]["Stream"]
+                # A stream that could not be sized is a mismatch, never a pass.
+                expected = template_sizes.get(template_stream)
+                actual = populated_sizes.get(name)
+                if expected is None or actual is None or expected != actual:
+                    report["files"]["mismatched"][name] = {
+                        "expected": _size_report(expected),
+                        "actual": _size_report(actual),
+                    }
+            report["files"]["checked"] = len(populated_streams)
+
+    report["queries"] = queries.count
+    report["ok"] = not (
+        report["users"]["missing"]
+        or report["groups"]["missing"]
+        or report["groups"]["missing_members"]
+        or report["protections"]["missing"]
+        or report["depots"]["missing"]
+        or report["streams"]["missing"]
+        or report["files"]["mismatched"]
+    )
+    logger.debug(f"Verification finished with {queries.count} queries: {report}")
+    return report
+
+
+def merge_verify_reports(reports):
+    """Combine verify_run reports for parts of one run into a single report."""
+    merged = {
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+        "users": {"expected": 0, "missing": []},
+        "groups": {"expected": 0, "missing": [], "missing_members": {}},
+        "protections": {"expected": 0, "missing": []},
+        "depots": {"expected": 0, "missing": []},
+        "streams": {"expected": 0, "missing": []},
+        "files": {"checked": 0, "mismatched": {}},
+        "queries": 0,
+    }
+    for report in reports:
+        for section in ("users", "groups", "protections", "depots", "streams"):
+            merged[section]["expected"] += report[section]["expected"]
+            merged[section]["missing"].extend(report[section]["missing"])
+        merged["groups"]["missing_members"].update(report["groups"]["missing_members"])
+        merged["files"]["checked"] += report["files"]["checked"]
+        merged["files"]["mismatched"].update(report["files"]["mismatched"])
+        merged["queries"] += report["queries"]
+    merged["ok"] = all(report["ok"] for report in reports)
+    return merged
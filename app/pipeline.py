@@ -0,0 +1,364 @@
+import logging
+
+import p4_utils
+import profiling
+from roster import Roster
+
+# Create a custom logger
+logger = logging.getLogger("main.pipeline")
+
+
+class SharedData:
+    def __init__(self):
+        self.roster = Roster()
+        self.template_depot = None
+        self.undo_commands = []
+        self.default_password = ""
+        self.require_password_reset = True
+        # A p4_utils.ServerIndex to plan against instead of scanning the server.
+        self.server_index = None
+        # {group: [usernames]} to take out of existing groups in the same
+        # group update that adds the roster's members.
+        self.group_removals = {}
+        # A p4_utils.StreamTemplate of template_depot, fetched on first use.
+        self.stream_template = None
+        # A p4_utils.TemplateCatalog with each template's streams and size.
+        self.template_catalog = None
+
+
+def prepare_data(shared_data):
+    logger.debug("Preparing Data:")
+    plan_users(shared_data)
+    plan_groups(shared_data)
+    plan_depots(shared_data)
+    plan_permissions(shared_data)
+
+
+def plan_users(shared_data):
+    with profiling.stage("plan_users"):
+        index = shared_data.server_index
+        if index:
+            index.recheck(users=[user["User"] for user in shared_data.roster.users()])
+        shared_data.users_to_create = p4_utils.check_users(
+            shared_data.roster.users(), index.users if index else None
+        )
+        logger.debug(f"Users to create: {shared_data.users_to_create}")
+        try:
+            shared_data.remaining_licenses = p4_utils.check_remaining_seats()
+        except p4_utils.P4Exception as e:
+            logger.error(f"Unable to check remaining seats: {e}")
+            shared_data.remaining_licenses = 0
+
+
+def plan_groups(shared_data):
+    with profiling.stage("plan_groups"):
+        index = shared_data.server_index
+        group_users = shared_data.roster.group_members()
+        if index:
+            index.recheck(groups=[*group_users, *shared_data.group_removals])
+        existing_group_names = (
+            index.groups if index else p4_utils.get_existing_group_names()
+        )
+        groups_to_process = {
+            group: {
+                "Group": group,
+                "Users": group_users[group]["Users"],
+                "Owners": group_users[group]["Owners"],
+            }
+            for group in group_users
+        }
+        for group, users in shared_data.group_removals.items():
+            if group not in existing_group_names:
+                logger.warning(f"Not removing {users} from {group}: no such group.")
+                continue
+            groups_to_process.setdefault(
+                group, {"Group": group, "Users": [], "Owners": []}
+            )["Remove"] = users
+        shared_data.groups_to_process = list(groups_to_process.values())
+        shared_data.groups_to_create = [
+            group
+            for group in shared_data.groups_to_process
+            if group["Group"] not in existing_group_names
+        ]
+        shared_data.groups_to_modify = [
+            group
+            for group in shared_data.groups_to_process
+            if group["Group"] in existing_group_names
+        ]
+        logger.debug(f"Groups to create: {shared_data.groups_to_create}")
+        logger.debug(f"Groups to modify: {shared_data.groups_to_modify}")
+
+
+def plan_depots(shared_data):
+    with profiling.stage("plan_depots"):
+        index = shared_data.server_index
+        if index:
+            index.recheck(depots=shared_data.roster.groups())
+        shared_data.depots_to_create = p4_utils.check_depots(
+            shared_data.roster.groups(), index.depots if index else None
+        )
+        logger.debug(f"Depots to create: {shared_data.depots_to_create}")
+
+
+def plan_permissions(shared_data):
+    with profiling.stage("plan_permissions"):
+        index = shared_data.server_index
+        shared_data.permissions_to_create = p4_utils.check_permissions(
+            shared_data.roster.groups(), index.protections if index else None
+        )
+        logger.debug(f"Permissions to create: {shared_data.permissions_to_create}")
+
+
+# Planning sections in the order they are shown on the creation page.
+PLAN_SECTIONS = {
+    "users": plan_users,
+    "groups": plan_groups,
+    "permissions": plan_permissions,
+    "depots": plan_depots,
+}
+
+
+def create_users(shared_data, progress_callback=None):
+    """Create the planned users and return the ones that were created.
+
+    Their undo commands are added to shared_data.undo_commands.
+    """
+    users_to_create = shared_data.users_to_create
+    # {username: steps done}. A task retried after a transient error skips
+    # the steps that already went through instead of repeating them.
+    finished = {}
+
+    def create_user_task(user):
+        logger.debug(f"User {user}")
+        steps = finished.setdefault(user["User"], set())
+        if "user" not in steps:
+            res = p4_utils.create_user(
+                {
+                    "User": user["User"],
+                    "Email": user["Email"],
+                    "FullName": user["FullName"],
+                }
+            )
+            logger.debug(f"{res}")
+            steps.add("user")
+        if "password" not in steps:
+            pw_res = p4_utils.set_initial_password(
+                user["User"], shared_data.default_password, False
+            )
+            logger.debug(f"Password set: {pw_res}")
+            steps.add("password")
+        if shared_data.require_password_reset and "reset" not in steps:
+            p4_utils.require_password_reset(user["User"])
+            steps.add("reset")
+
+    with profiling.stage("create_users"):
+        _, errors = p4_utils.run_parallel(
+            profiling.wrap(create_user_task), users_to_create, progress_callback
+        )
+    for i, error in errors.items():
+        logger.error(f"Error creating user {users_to_create[i]['User']}: {error}")
+    users_created = [
+        user for i, user in enumerate(users_to_create) if i not in errors
+    ]
+
+    undo_commands = [f"p4 user -df {user['User']}" for user in users_created]
+    shared_data.undo_commands.extend(undo_commands)
+    undo_commands_str = "\n".join(undo_commands)
+    logger.debug(f"Users created. Undo commands below:\n{undo_commands_str}")
+    return users_created
+
+
+def create_groups(shared_data, progress_callback=None):
+    """Create or update the planned groups and return the new ones that were created.
+
+    Their undo commands are added to shared_data.undo_commands.
+    """
+    groups_to_process = shared_data.groups_to_process
+    with profiling.stage("create_groups"):
+        _, errors = p4_utils.run_parallel(
+            profiling.wrap(p4_utils.create_group), groups_to_process, progress_callback
+        )
+    for i, error in errors.items():
+        logger.error(f"Error updating group {groups_to_process[i]['Group']}: {error}")
+    failed_groups = {groups_to_process[i]["Group"] for i in errors}
+    groups_created = [
+        group
+        for group in shared_data.groups_to_create
+        if group["Group"] not in failed_groups
+    ]
+    groups_modified = [
+        group
+        for group in shared_data.groups_to_modify
+        if group["Group"] not in failed_groups
+    ]
+
+    undo_commands = [
+        "# Commands to delete groups which were added and remove their permissions:"
+    ]
+    undo_commands += [
+        f"p4 group -dF {group['Group']}" for group in groups_created
+    ] or ["# --> No groups were created."]
+    undo_commands += ["# Groups which were modified (cannot easily undo):"]
+    undo_commands += [
+        f"p4 group -o {group['Group']}" for group in groups_modified
+    ] or ["# --> No groups were modified."]
+    shared_data.undo_commands.extend(undo_commands)
+    undo_commands_str = "\n".join(undo_commands)
+    logger.debug(f"Groups created. Undo commands below:\n{undo_commands_str}")
+    return groups_created
+
+
+def create_permissions(shared_data, progress_callback=None):
+    """Add the planned protections lines and return the ones that were added."""
+    permissions_created = []
+    with profiling.stage("create_permissions"):
+        if shared_data.permissions_to_create:
+            p4_utils.execute(
+                p4_utils.create_permissions, shared_data.permissions_to_create
+            )
+            permissions_created = shared_data.permissions_to_create
+    if progress_callback:
+        progress_callback.emit(1)
+    added_lines = "\n".join(permissions_created)
+    logger.debug(
+        f"Permissions created. New lines below. Deleting groups with -dF command should remove permissions lines:\n{added_lines}"
+    )
+    return permissions_created
+
+
+def get_stream_template(shared_data):
+    """The template depot's parsed streams, fetched once per shared_data.
+
+    With a template catalog, its cached specs are reused if they still match
+    the server.
+    """
+    if shared_data.stream_template is None:
+        template_name = shared_data.template_depot["name"]
+        catalog = shared_data.template_catalog
+        shared_data.stream_template = (
+            catalog.stream_template(template_name)
+            if catalog is not None
+            else p4_utils.get_stream_template(template_name)
+        )
+    return shared_data.stream_template
+
+
+def create_depots(shared_data, progress_callback=None):
+    """Create the planned depots with the template's streams and return the ones created.
+
+    Their undo commands are added to shared_data.undo_commands.
+    """
+    depots_to_create = shared_data.depots_to_create
+    template_depot = shared_data.template_depot
+
+    # {depot: streams created}, so a retried task skips what already went through.
+    finished = {}
+
+    def create_depot_task(depot_name):
+        if depot_name not in finished:
+            p4_utils.create_depot(depot_name, template_depot["type"])
+            finished[depot_name] = set()
+        streams_to_create = stream_template.for_depot(depot_name)
+        for stream in streams_to_create:
+            if stream["Stream"] not in finished[depot_name]:
+                p4_utils.create_stream(stream)
+                finished[depot_name].add(stream["Stream"])
+        created_streams = [stream["Stream"] for stream in streams_to_create]
+        logger.debug(f"Created depot {depot_name} with streams {created_streams}")
+        return created_streams
+
+    with profiling.stage("create_depots"):
+        # Fetched and parsed once, then retargeted for each new depot.
+        stream_template = get_stream_template(shared_data) if depots_to_create else None
+        results, errors = p4_utils.run_parallel(
+            profiling.wrap(create_depot_task), depots_to_create, progress_callback
+        )
+    for i, error in errors.items():
+        logger.error(f"Error creating depot {depots_to_create[i]}: {error}")
+
+    undo_commands = []
+    depots_created = []
+    for depot_name, created_streams in zip(depots_to_create, results):
+        if created_streams is None:
+            continue
+        depots_created.append(depot_name)
+        undo_commands.extend(
+            f"p4 stream --obliterate -y {stream}" for stream in reversed(created_streams)
+        )
+        undo_commands.extend(
+            (
+                f"p4 obliterate -y //{depot_name}/...",
+                f"p4 depot -d {depot_name}",
+            )
+        )
+    shared_data.undo_commands.extend(undo_commands)
+    undo_commands_str = "\n".join(undo_commands)
+    logger.debug(f"Depots created. Undo commands below:\n{undo_commands_str}")
+    return depots_created
+
+
+def populate_depots(shared_data, progress_callback=None):
+    depots_to_create = shared_data.depots_to_create
+    template_depot_name = shared_data.template_depot["name"]
+
+    # {depot: target streams populated}, kept across retries of a task.
+    populated = {}
+
+    def populate_depot_task(depot_name):
+        # A retry checks the remaining streams first, as the error may have
+        # hidden a populate that the server finished.
+        retrying = depot_name in populated
+        p4_utils.populate_new_depot(
+            template_depot_name,
+            depot_name,
+            template_streams,
+            populated=populated.setdefault(depot_name, set()),
+            check_head=retrying,
+        )
+
+    with profiling.stage("populate_depots"):
+        template_streams = (
+            get_stream_template(shared_data).streams if depots_to_create else []
+        )
+        _, errors = p4_utils.run_parallel(
+            profiling.wrap(populate_depot_task), depots_to_create, progress_callback
+        )
+    for i, error in errors.items():
+        logger.warning(f"Error populating depot {depots_to_create[i]}: {error}")
+
+
+def record_applied(
+    shared_data,
+    users_created=(),
+    groups_created=(),
+    depots_created=(),
+    permissions_created=(),
+):
+    """Add what this run created to the shared server index, if any.
+
+    users_created/groups_created/depots_created/permissions_created: what
+    create_users, create_groups, create_depots and create_permissions
+    returned, so failed creations are left out. Stages that never ran
+    created nothing.
+    """
+    if shared_data.server_index is None:
+        return
+    shared_data.server_index.add(
+        users=[user["User"] for user in users_created],
+        groups=[group["Group"] for group in groups_created],
+        depots=depots_created,
+        protections=permissions_created,
+    )
+
+
+def verify(shared_data, populated=False):
+    """Check the planned objects exist and return the verification report."""
+    roster = shared_data.roster
+    with profiling.stage("verify"):
+        return p4_utils.verify_run(
+            users=[user["User"] for user in roster.users()],
+            group_members=roster.group_members(),
+            depots=roster.groups(),
+            template_depot_name=shared_data.template_depot["name"],
+            populated_depots=shared_data.depots_to_create if populated else None,
+        )
@@ -0,0 +1,160 @@
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Create a custom logger
+logger = logging.getLogger("main.profiling")
+
+TOP_ALLOCATIONS = 15
+TOP_FUNCTIONS = 30
+# From Python 3.12, cProfile runs on sys.monitoring: one profiler at a time for
+# the whole process, and it sees every thread rather than just its own.
+SHARED_PROFILER = sys.version_info >= (3, 12)
+
+_enabled = False
+_directory = Path(".")
+_run_stamp = ""
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_active_stages = 0
+
+
+def enable(directory=Path(".")):
+    """Turn on per-stage CPU and memory profiling for the rest of the run."""
+    global _enabled, _directory, _run_stamp
+    _enabled = True
+    _directory = Path(directory)
+    _run_stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    logger.info(f"Profiling enabled. Reports will be written to {_directory.absolute()}")
+
+
+def is_enabled():
+    return _enabled
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def add_profile(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+
+
+@contextmanager
+def stage(name):
+    """Profile the enclosed block as one named stage and write its report.
+
+    CPU time is profiled for the calling thread plus any functions passed
+    through `wrap` while the stage is active (e.g. tasks run by
+    p4_utils.run_parallel). On Python 3.12+ the stage's profiler already sees
+    every thread, and only one can run at once, so a stage that overlaps
+    another one (the GUI's planning stages) skips its CPU profile. Memory is
+    tracked with tracemalloc, which sees the whole process, so stages that
+    overlap in the GUI share their peak.
+    """
+    global _active_stages
+    if not _enabled:
+        yield
+        return
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        _active_stages += 1
+        # reset_peak() is new in Python 3.9; before that the peak is the run's.
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    current_stage = _Stage(name)
+    previous_stage = getattr(_local, "stage", None)
+    _local.stage = current_stage
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another stage's profiler is active (Python 3.12+).
+        logger.debug(f"Another stage is being profiled, skipping CPU profile of {name}")
+        profile = None
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+        elapsed = time.perf_counter() - start
+        _local.stage = previous_stage
+        if profile is not None:
+            current_stage.add_profile(profile)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        _write_report(current_stage, elapsed, peak, before, after)
+        with _tracing_lock:
+            _active_stages -= 1
+            if _active_stages == 0:
+                tracemalloc.stop()
+
+
+def wrap(func):
+    """Profile func into the calling thread's active stage, wherever it runs."""
+    current_stage = getattr(_local, "stage", None)
+    if current_stage is None or SHARED_PROFILER:
+        # On Python 3.12+ the stage's own profiler already covers func.
+        return func
+
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            current_stage.add_profile(profile)
+
+    profiled.__name__ = func.__name__
+    return profiled
+
+
+def _write_report(current_stage, elapsed, peak, before, after):
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]
+    allocations = (
+        after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    )
+
+    functions = io.StringIO()
+    if current_stage.profiles:
+        stats = pstats.Stats(*current_stage.profiles, stream=functions)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    else:
+        functions.write("  Skipped: another stage was being profiled at the same time.\n")
+
+    lines = [
+        f"Stage: {current_stage.name}",
+        f"Wall time: {elapsed:.3f}s",
+        f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB",
+        f"Profiles merged: {len(current_stage.profiles)} (stage thread + wrapped tasks)",
+        "",
+        f"Top {TOP_ALLOCATIONS} allocations (net change during stage):",
+    ]
+    lines += [f"  {stat}" for stat in allocations[:TOP_ALLOCATIONS]]
+    lines += ["", f"Top {TOP_FUNCTIONS} functions by cumulative time:"]
+    lines.append(functions.getvalue())
+
+    report_file = _directory / f"profile_{_run_stamp}_{current_stage.name}.txt"
+    with open(report_file, "w") as f:
+        f.write("\n".join(lines))
+    logger.info(
+        f"Profiled {current_stage.name}: {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f} MiB -> {report_file}"
+    )
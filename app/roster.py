@@ -0,0 +1,83 @@
+import sys
+
+
+class RosterRow:
+    """One validated CSV row, with the username parsed out of the email once."""
+
+    __slots__ = ("full_name", "email", "user", "group", "owner")
+
+    def __init__(self, full_name: str, email: str, group: str, owner: bool):
+        self.full_name = full_name
+        self.email = email
+        # Usernames and group names repeat across rows and end up in many
+        # specs, so intern them to share one string object per name.
+        self.user = sys.intern(email.split("@")[0])
+        self.group = sys.intern(group)
+        self.owner = bool(owner)
+
+    def as_list(self) -> list:
+        return [self.full_name, self.email, self.group, self.owner]
+
+    def __repr__(self):
+        return f"RosterRow({self.as_list()})"
+
+
+class Roster:
+    """The loaded CSV, shared by the table view, the planner and the workers."""
+
+    def __init__(self, rows=None):
+        self.rows = list(rows or [])
+        self._users = None
+        self._group_members = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def append(self, row: list):
+        self.rows.append(RosterRow(*row))
+        self._invalidate()
+
+    def update(self, index: int, column: int, value):
+        values = self.rows[index].as_list()
+        values[column] = value
+        self.rows[index] = RosterRow(*values)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._users = None
+        self._group_members = None
+
+    def users(self) -> list:
+        """User specs for every unique username in the roster."""
+        if self._users is None:
+            users = {}
+            for row in self.rows:
+                users.setdefault(
+                    row.user,
+                    {"User": row.user, "Email": row.email, "FullName": row.full_name},
+                )
+            self._users = list(users.values())
+        return self._users
+
+    def group_members(self) -> dict:
+        """Map each group name to its {"Users": [...], "Owners": [...]} lists."""
+        if self._group_members is None:
+            group_members = {}
+            for row in self.rows:
+                members = group_members.setdefault(
+                    row.group, {"Users": [], "Owners": []}
+                )
+                if row.owner:
+                    members["Owners"].append(row.user)
+                members["Users"].append(row.user)
+            self._group_members = group_members
+        return self._group_members
+
+    def groups(self) -> list:
+        return list(self.group_members())
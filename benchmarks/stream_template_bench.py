@@ -0,0 +1,130 @@
+"""Time retargeting a template depot's stream specs to many new depots.
+
+Compares the old approach (str.replace over every field of every spec,
+per depot) with p4_utils.StreamTemplate (parse once, join per depot).
+Uses synthetic specs, so no server is needed:
+
+    python benchmarks/stream_template_bench.py [--depots 1000] [--streams 20]
+"""
+import argparse
+import copy
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from p4_utils import StreamTemplate  # noqa: E402
+
+TEMPLATE = "game_template"
+
+
+def make_specs(stream_count):
+    specs = [
+        {
+            "Stream": f"//{TEMPLATE}/main",
+            "Name": "main",
+            "Parent": "none",
+            "Type": "mainline",
+            "Owner": "admin",
+            "Description": f"Mainline of {TEMPLATE}.",
+            "Options": "allsubmit unlocked notoparent nofromparent mergedown",
+            "ParentView": "inherit",
+            "Paths": ["share ...", f"import engine/... //{TEMPLATE}_engine/main/..."],
+            "Remapped": [],
+            "Ignored": [".vs/...", "Binaries/...", "Intermediate/..."],
+            "Update": "2023/01/01 00:00:00",
+            "Access": "2023/01/01 00:00:00",
+        }
+    ]
+    for i in range(1, stream_count):
+        specs.append(
+            {
+                "Stream": f"//{TEMPLATE}/dev{i}",
+                "Name": f"dev{i}",
+                "Parent": f"//{TEMPLATE}/main",
+                "Type": "development",
+                "Owner": "admin",
+                "Description": f"Development stream {i} branched from {TEMPLATE}.",
+                "Options": "allsubmit unlocked toparent fromparent mergedown",
+                "ParentView": "inherit",
+                "Paths": ["share ...", f"import art/... //{TEMPLATE}/art/..."],
+                "Remapped": [],
+                "Ignored": [".vs/...", "Binaries/..."],
+                "Update": "2023/01/01 00:00:00",
+                "Access": "2023/01/01 00:00:00",
+            }
+        )
+    return specs
+
+
+def str_replace_streams(specs, template_depot_name, new_depot_name):
+    """The previous get_streams rewrite, minus the server queries."""
+    exclude_keys = [
+        "Update",
+        "Access",
+        "baseParent",
+        "streamSpecDigest",
+        "firmerThanParent",
+    ]
+    streams_details = copy.deepcopy(specs)
+    for stream in streams_details:
+        for key in exclude_keys:
+            stream.pop(key, None)
+        for key in stream:
+            if isinstance(stream[key], str):
+                stream[key] = stream[key].replace(template_depot_name, new_depot_name)
+            elif isinstance(stream[key], list):
+                stream[key] = [
+                    value.replace(template_depot_name, new_depot_name)
+                    for value in stream[key]
+                ]
+
+    def get_parents(stream):
+        parents = []
+        while stream:
+            parents.insert(0, stream["Stream"])
+            stream = next(
+                (
+                    item
+                    for item in streams_details
+                    if item["Stream"] == stream["Parent"]
+                ),
+                None,
+            )
+        return parents
+
+    return sorted(streams_details, key=lambda x: get_parents(x))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depots", type=int, default=1000)
+    parser.add_argument("--streams", type=int, default=20)
+    args = parser.parse_args()
+    specs = make_specs(args.streams)
+    depots = [f"202430_356_team{i}" for i in range(args.depots)]
+
+    start = time.perf_counter()
+    for depot in depots:
+        str_replace_streams(specs, TEMPLATE, depot)
+    replace_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template = StreamTemplate(TEMPLATE, specs)
+    parse_time = time.perf_counter() - start
+    for depot in depots:
+        template.for_depot(depot)
+    template_time = time.perf_counter() - start
+
+    print(f"{args.depots} depots x {args.streams} streams")
+    print(f"  str.replace per depot:  {replace_time * 1000:8.1f} ms")
+    print(
+        f"  StreamTemplate:         {template_time * 1000:8.1f} ms "
+        f"(parse once: {parse_time * 1000:.2f} ms)"
+    )
+    print(f"  speedup:                {replace_time / template_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
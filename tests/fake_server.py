@@ -0,0 +1,62 @@
+import os
+import sys
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from P4 import P4  # noqa: E402
+
+
+class FakeServer:
+    """Answers every P4.run call from canned tagged records instead of a server.
+
+    responses maps a command name to a list of records, an exception to
+    raise, or a callable(args) returning either. Output handlers see the
+    records one at a time, as with a real server. Every command run is kept
+    in `commands`, with the connection's input at the time in `inputs`.
+    """
+
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.commands = []
+        self.inputs = []
+
+    def run(self, connection, *args, **kwargs):
+        args = [str(arg) for arg in args]
+        self.commands.append(args)
+        self.inputs.append(getattr(connection, "input", None))
+        response = self.responses.get(args[0], [])
+        if callable(response):
+            response = response(args)
+        if isinstance(response, Exception):
+            raise response
+        handler = connection.handler
+        if handler is None:
+            return list(response)
+        results = []
+        for record in response:
+            outcome = handler.outputStat(record)
+            if outcome == P4.OutputHandler.CANCEL:
+                break
+            if outcome == P4.OutputHandler.REPORT:
+                results.append(record)
+        return results
+
+    def ran(self, command):
+        """The arguments of every `command` run so far."""
+        return [args for args in self.commands if args[0] == command]
+
+    @contextmanager
+    def serving(self):
+        """Route every connection's commands to this server for the duration."""
+
+        def run(connection, *args, **kwargs):
+            return self.run(connection, *args, **kwargs)
+
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(P4, "run", run))
+            # Worker threads open their own connections; never reach a server.
+            stack.enter_context(mock.patch.object(P4, "connect", lambda c: c))
+            stack.enter_context(mock.patch.object(P4, "connected", lambda c: True))
+            yield self
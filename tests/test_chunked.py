@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+
+from fake_server import FakeServer
+
+import chunked
+
+
+class SlicesTest(unittest.TestCase):
+    def test_rows_are_split_in_order(self):
+        self.assertEqual(list(chunked.slices(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_rows_are_read_lazily(self):
+        read = []
+
+        def rows():
+            for i in range(10):
+                read.append(i)
+                yield i
+
+        chunks = chunked.slices(rows(), 4)
+        self.assertEqual(next(chunks), [0, 1, 2, 3])
+        self.assertEqual(read, [0, 1, 2, 3])
+
+    def test_no_rows_means_no_slices(self):
+        self.assertEqual(list(chunked.slices([], 3)), [])
+
+
+class MembershipSpillTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.spill = chunked.MembershipSpill(directory=self.directory)
+
+    def test_add_returns_only_new_groups(self):
+        self.assertEqual(
+            self.spill.add(
+                {
+                    "c1": {"Users": ["alee", "bdiaz"], "Owners": ["alee"]},
+                    "c2": {"Users": ["cng"], "Owners": []},
+                }
+            ),
+            ["c1", "c2"],
+        )
+        self.assertEqual(
+            self.spill.add(
+                {
+                    "c2": {"Users": ["dfox"], "Owners": []},
+                    "c3": {"Users": ["efox"], "Owners": []},
+                }
+            ),
+            ["c3"],
+        )
+        self.spill.close()
+
+    def test_members_merge_across_slices(self):
+        self.spill.add({"c1": {"Users": ["alee", "bdiaz"], "Owners": []}})
+        # bdiaz turns up again as an owner; alee is not repeated.
+        self.spill.add({"c1": {"Users": ["bdiaz", "cng"], "Owners": ["bdiaz"]}})
+        self.assertEqual(
+            self.spill.members(["c1"]),
+            {"c1": {"Users": ["alee", "bdiaz", "cng"], "Owners": ["bdiaz"]}},
+        )
+        self.spill.close()
+
+    def test_owners_stay_owners(self):
+        self.spill.add({"c1": {"Users": ["alee"], "Owners": ["alee"]}})
+        self.spill.add({"c1": {"Users": ["alee"], "Owners": []}})
+        self.assertEqual(self.spill.members(["c1"])["c1"]["Owners"], ["alee"])
+        self.spill.close()
+
+    def test_group_chunks_cover_every_group_once(self):
+        self.spill.add(
+            {f"g{i:02}": {"Users": [f"u{i}"], "Owners": []} for i in range(5)}
+        )
+        self.assertEqual(
+            list(self.spill.group_chunks(2)),
+            [["g00", "g01"], ["g02", "g03"], ["g04"]],
+        )
+        self.assertEqual(
+            self.spill.members(["g03"]), {"g03": {"Users": ["u3"], "Owners": []}}
+        )
+        self.spill.close()
+
+    def test_close_removes_the_file(self):
+        path = self.spill.path
+        self.assertEqual(os.path.dirname(path), self.directory)
+        self.spill.close()
+        self.assertFalse(os.path.exists(path))
+
+
+class RunChunkedTest(unittest.TestCase):
+    def test_verification_lists_the_server_once(self):
+        base_data = chunked.SharedData()
+        base_data.template_depot = {"name": "tpl", "type": "stream"}
+        rows = [[f"User {i}", f"u{i}@school.edu", f"g{i}", False] for i in range(5)]
+        server = FakeServer(
+            {
+                "license": [{"userLimit": "100", "userCount": "1"}],
+                "protect": [{"Protections": []}],
+            }
+        )
+        with tempfile.TemporaryDirectory() as directory, server.serving():
+            report = chunked.run_chunked(
+                base_data, rows, os.path.join(directory, "undo.txt"), chunk_size=2
+            )
+        # Once while planning and once for all three chunks' checks.
+        self.assertEqual(len(server.ran("groups")), 2)
+        self.assertEqual(report["groups"]["expected"], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,246 @@
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import p4_utils  # noqa: E402
+from p4_utils import concurrency, P4Exception  # noqa: E402
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping just moves the clock forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FlakyCall:
+    """Raises the given exceptions in turn, then returns result."""
+
+    def __init__(self, *exceptions, result="ok"):
+        self.exceptions = list(exceptions)
+        self.result = result
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        if self.exceptions:
+            raise self.exceptions.pop(0)
+        return self.result
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (
+            mock.patch.object(concurrency, "time", self.clock),
+            # The longest possible backoff, so the delays are predictable.
+            mock.patch.object(concurrency.random, "uniform", lambda low, high: high),
+            mock.patch.object(concurrency, "p4"),
+            mock.patch.object(p4_utils, "reconnect"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        concurrency.p4.connected.return_value = True
+
+
+class ErrorClassificationTest(unittest.TestCase):
+    def test_transient_errors(self):
+        for message in (
+            "Request too large (over 500000); see 'p4 help maxresults'. MaxCommands",
+            "Too many commands running on the server",
+            "Operation took too long",
+            "TCP receive failed.",
+            "Partner exited unexpectedly",
+        ):
+            self.assertTrue(concurrency.is_transient(P4Exception(message)), message)
+
+    def test_permanent_errors(self):
+        for message in (
+            "Depot 'foo' doesn't exist.",
+            "You don't have permission for this operation.",
+            "Invalid user name.",
+        ):
+            self.assertFalse(concurrency.is_transient(P4Exception(message)), message)
+
+    def test_only_lost_connections_are_disconnects(self):
+        self.assertTrue(concurrency.is_disconnect(P4Exception("tcp send failed")))
+        self.assertTrue(concurrency.is_disconnect(P4Exception("Connection reset")))
+        self.assertFalse(concurrency.is_disconnect(P4Exception("Too many commands")))
+
+
+class AdaptiveLimiterTest(ConcurrencyTestCase):
+    def succeed(self, limiter, latency=0.01, times=1):
+        for _ in range(times):
+            limiter.acquire()
+            limiter.release(latency)
+
+    def test_fast_successes_grow_the_limit_up_to_the_maximum(self):
+        limiter = concurrency.AdaptiveLimiter(initial=2, maximum=6)
+        self.succeed(limiter, times=2)
+        # Additive increase: about one slot per window of `limit` successes.
+        self.assertAlmostEqual(limiter.limit, 2.9)
+        self.succeed(limiter, times=200)
+        self.assertEqual(limiter.limit, 6)
+        self.assertEqual(limiter.metrics()["successes"], 202)
+
+    def test_throttling_halves_the_limit_once_per_cooldown(self):
+        limiter = concurrency.AdaptiveLimiter(initial=8, maximum=8, cooldown=1.0)
+        limiter.acquire()
+        limiter.release(0.01, throttled=True)
+        self.assertEqual(limiter.limit, 4)
+        # A burst of errors from the same moment only backs off once.
+        limiter.acquire()
+        limiter.release(0.01, throttled=True)
+        self.assertEqual(limiter.limit, 4)
+        self.clock.now += 1.0
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(0.01, throttled=True)
+            self.clock.now += 1.0
+        self.assertEqual(limiter.limit, 1)
+        self.assertEqual(limiter.metrics()["throttled"], 7)
+
+    def test_latency_spike_counts_as_pressure(self):
+        limiter = concurrency.AdaptiveLimiter(initial=4, maximum=8)
+        self.succeed(limiter, latency=0.1)
+        before = limiter.limit
+        self.clock.now += 10
+        self.succeed(limiter, latency=1.0)
+        self.assertEqual(limiter.limit, before / 2)
+
+    def test_slow_operations_under_the_floor_are_not_spikes(self):
+        limiter = concurrency.AdaptiveLimiter(initial=2, maximum=8, latency_floor=0.05)
+        self.succeed(limiter, latency=0.001)
+        self.succeed(limiter, latency=0.04)
+        self.assertGreater(limiter.limit, 2)
+
+    def test_permanent_failures_leave_the_limit_alone(self):
+        limiter = concurrency.AdaptiveLimiter(initial=3)
+        limiter.acquire()
+        limiter.release(0.01, failed=True)
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(limiter.metrics()["failures"], 1)
+
+    def test_acquire_waits_for_a_free_slot(self):
+        limiter = concurrency.AdaptiveLimiter(initial=1, maximum=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def second():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=second)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(0.01)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(limiter.in_flight, 1)
+
+
+class RateLimiterTest(ConcurrencyTestCase):
+    def test_calls_are_spaced_out(self):
+        limiter = concurrency.RateLimiter(4)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [0.25, 0.25])
+
+    def test_idle_time_is_not_saved_up(self):
+        limiter = concurrency.RateLimiter(2)
+        limiter.acquire()
+        self.clock.now += 10
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+
+class ExecuteTest(ConcurrencyTestCase):
+    def test_transient_errors_are_retried_with_growing_backoff(self):
+        limiter = concurrency.AdaptiveLimiter()
+        func = FlakyCall(
+            P4Exception("Too many commands"), P4Exception("Too many commands")
+        )
+        result = concurrency.execute(func, limiter=limiter, base_delay=0.5)
+        self.assertEqual(result, "ok")
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0])
+        metrics = limiter.metrics()
+        self.assertEqual((metrics["retries"], metrics["throttled"]), (2, 2))
+        self.assertEqual(metrics["in_flight"], 0)
+
+    def test_backoff_is_capped(self):
+        func = FlakyCall(*[P4Exception("database is locked")] * 4)
+        concurrency.execute(func, retries=4, base_delay=1.0, max_delay=5.0)
+        self.assertEqual(self.clock.sleeps, [2.0, 4.0, 5.0, 5.0])
+
+    def test_permanent_errors_are_raised_at_once(self):
+        limiter = concurrency.AdaptiveLimiter()
+        func = FlakyCall(P4Exception("Depot 'x' doesn't exist."))
+        with self.assertRaises(P4Exception):
+            concurrency.execute(func, limiter=limiter)
+        self.assertEqual(func.calls, 1)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(limiter.metrics()["failures"], 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_gives_up_after_the_last_retry(self):
+        func = FlakyCall(*[P4Exception("Too many commands")] * 3)
+        with self.assertRaises(P4Exception):
+            concurrency.execute(func, retries=2)
+        self.assertEqual(func.calls, 3)
+
+    def test_lost_connections_are_reopened_before_retrying(self):
+        func = FlakyCall(P4Exception("TCP receive failed."))
+        concurrency.execute(func)
+        p4_utils.reconnect.assert_called_once_with()
+
+    def test_throttling_keeps_the_connection(self):
+        func = FlakyCall(P4Exception("Too many commands"))
+        concurrency.execute(func)
+        p4_utils.reconnect.assert_not_called()
+
+    def test_other_exceptions_release_the_slot(self):
+        limiter = concurrency.AdaptiveLimiter()
+        with self.assertRaises(ValueError):
+            concurrency.execute(FlakyCall(ValueError("bad")), limiter=limiter)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.metrics()["failures"], 1)
+
+
+class RunParallelTest(ConcurrencyTestCase):
+    def test_results_keep_item_order_and_errors_are_keyed_by_index(self):
+        def task(item):
+            if item % 3 == 0:
+                raise P4Exception(f"Item {item} is not allowed.")
+            return item * 10
+
+        progress = mock.Mock()
+        results, errors = concurrency.run_parallel(
+            task, range(7), progress_callback=progress
+        )
+        self.assertEqual(results, [None, 10, 20, None, 40, 50, None])
+        self.assertEqual(sorted(errors), [0, 3, 6])
+        self.assertEqual(str(errors[3]), "Item 3 is not allowed.")
+        self.assertEqual(
+            [call.args[0] for call in progress.emit.call_args_list], list(range(1, 8))
+        )
+
+    def test_no_items(self):
+        self.assertEqual(concurrency.run_parallel(lambda item: item, []), ([], {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import enrollment  # noqa: E402
+
+
+def validate_row(i, row):
+    """Stand-in for main.validate_csv_row: [name, email, group, owner]."""
+    name, email, group, owner = row
+    if "@" not in email:
+        raise ValueError(f"Row {i}: invalid email {email!r}")
+    return [name, email, group, owner.lower() == "true"]
+
+
+class StubApplier:
+    """Records every batch instead of touching a server."""
+
+    def __init__(self, result=True):
+        self.result = result
+        self.batches = []
+        self.applied = threading.Event()
+
+    def __call__(self, rows, removals):
+        self.batches.append((rows, removals))
+        self.applied.set()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class MergeEventsTest(unittest.TestCase):
+    def test_last_event_for_a_user_and_group_wins(self):
+        rows, removals = enrollment.merge_events(
+            [
+                {"action": "add", "name": "A", "email": "a@x.edu", "group": "g1"},
+                {"action": "remove", "user": "a", "group": "g1"},
+                {"action": "remove", "email": "b@x.edu", "group": "g2"},
+                {"action": "add", "name": "B", "email": "b@x.edu", "group": "g2"},
+                {"action": "remove", "user": "c", "group": "g1"},
+            ],
+            validate_row,
+        )
+        self.assertEqual(rows, [["B", "b@x.edu", "g2", False]])
+        self.assertEqual(removals, {"g1": ["a", "c"]})
+
+    def test_bad_events_are_rejected(self):
+        for event in (
+            {"action": "rename", "user": "a", "group": "g1"},
+            {"action": "remove", "group": "g1"},
+            {"action": "add", "name": "A", "email": "not-an-email", "group": "g1"},
+        ):
+            with self.assertRaises(Exception):
+                enrollment.merge_events([event], validate_row)
+
+
+class EnrollmentCoalescerTest(unittest.TestCase):
+    def test_events_within_the_window_are_applied_as_one_batch(self):
+        apply_batch = StubApplier()
+        coalescer = enrollment.EnrollmentCoalescer(
+            apply_batch, validate_row, window=0.3
+        )
+        coalescer.start()
+        try:
+            coalescer.submit(
+                [{"action": "add", "name": "A", "email": "a@x.edu", "group": "g1"}]
+            )
+            coalescer.submit(
+                [{"action": "add", "name": "B", "email": "b@x.edu", "group": "g1"}]
+            )
+            self.assertTrue(wait_for(lambda: coalescer.status()["recent"]))
+        finally:
+            coalescer.stop()
+        self.assertEqual(len(apply_batch.batches), 1)
+        rows, removals = apply_batch.batches[0]
+        self.assertEqual([row[1] for row in rows], ["a@x.edu", "b@x.edu"])
+        self.assertEqual(removals, {})
+        self.assertEqual(coalescer.status()["recent"][0]["events"], 2)
+
+    def test_max_batch_splits_a_burst(self):
+        apply_batch = StubApplier()
+        coalescer = enrollment.EnrollmentCoalescer(
+            apply_batch, validate_row, window=60, max_batch=2
+        )
+        coalescer.start()
+        try:
+            coalescer.submit(
+                [{"action": "remove", "user": f"u{i}", "group": "g1"} for i in range(4)]
+            )
+            self.assertTrue(wait_for(lambda: len(coalescer.status()["recent"]) == 2))
+        finally:
+            coalescer.stop()
+        self.assertEqual(
+            [removals for _, removals in apply_batch.batches],
+            [{"g1": ["u0", "u1"]}, {"g1": ["u2", "u3"]}],
+        )
+
+    def test_a_failing_batch_is_reported(self):
+        apply_batch = StubApplier(result=RuntimeError("server went away"))
+        coalescer = enrollment.EnrollmentCoalescer(apply_batch, validate_row, window=0)
+        coalescer.start()
+        try:
+            coalescer.submit([{"action": "remove", "user": "a", "group": "g1"}])
+            self.assertTrue(wait_for(lambda: coalescer.status()["recent"]))
+        finally:
+            coalescer.stop()
+        result = coalescer.status()["recent"][0]
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["error"], "server went away")
+
+
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        self.apply_batch = StubApplier()
+        self.coalescer = enrollment.EnrollmentCoalescer(
+            self.apply_batch, validate_row, window=0.2
+        )
+        ready = threading.Event()
+        servers = []
+
+        def on_ready(server):
+            servers.append(server)
+            ready.set()
+
+        self.thread = threading.Thread(
+            target=enrollment.serve,
+            args=(self.coalescer, 0),
+            kwargs={"on_ready": on_ready},
+            daemon=True,
+        )
+        self.thread.start()
+        self.assertTrue(ready.wait(5))
+        self.server = servers[0]
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def request(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data)
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_posted_events_are_applied_and_reported(self):
+        status, body = self.request(
+            "/events",
+            [
+                {"action": "add", "name": "A", "email": "a@x.edu", "group": "g1"},
+                {"action": "remove", "user": "b", "group": "g1"},
+            ],
+        )
+        self.assertEqual(status, 202)
+        self.assertEqual(body["accepted"], 2)
+        status, body = self.request(
+            "/events", {"action": "add", "name": "C", "email": "c@x.edu", "group": "g2"}
+        )
+        self.assertEqual(status, 202)
+
+        self.assertTrue(self.apply_batch.applied.wait(5))
+        self.assertTrue(wait_for(lambda: self.coalescer.status()["recent"]))
+        status, body = self.request("/status")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["pending"], 0)
+        self.assertEqual(body["batches"], 1)
+        self.assertTrue(body["recent"][0]["ok"])
+        self.assertEqual(body["recent"][0]["events"], 3)
+        rows, removals = self.apply_batch.batches[0]
+        self.assertEqual([row[2] for row in rows], ["g1", "g2"])
+        self.assertEqual(removals, {"g1": ["b"]})
+
+    def test_bad_requests_are_rejected_and_not_queued(self):
+        for body in (
+            {"action": "add", "name": "A", "email": "nope", "group": "g1"},
+            [{"action": "remove", "group": "g1"}],
+            "not an event",
+        ):
+            status, response = self.request("/events", body)
+            self.assertEqual(status, 400)
+            self.assertIn("error", response)
+        self.assertEqual(self.request("/missing")[0], 404)
+        self.assertEqual(self.coalescer.status()["pending"], 0)
+        self.assertEqual(self.apply_batch.batches, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
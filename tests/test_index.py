@@ -0,0 +1,101 @@
+import unittest
+
+from fake_server import FakeServer
+
+import pipeline
+import p4_utils
+
+# What exists on the server; the index below was refreshed before
+# bdiaz, c2 and its depot were created by someone else.
+SERVER_USERS = ["alee", "bdiaz"]
+SERVER_GROUPS = ["c1", "c2"]
+SERVER_DEPOTS = ["c1", "c2"]
+
+
+def make_server():
+    return FakeServer(
+        {
+            "users": lambda args: [
+                {"User": user} for user in args[1:] if user in SERVER_USERS
+            ],
+            # `p4 groups -v name` and `p4 depots -e name`.
+            "groups": lambda args: (
+                [{"group": args[-1]}] if args[-1] in SERVER_GROUPS else []
+            ),
+            "depots": lambda args: (
+                [{"name": args[-1], "type": "stream"}]
+                if args[-1] in SERVER_DEPOTS
+                else []
+            ),
+            "protect": [{"Protections": ["write group c1 * //c1/..."]}],
+            "license": [{"userLimit": "100", "userCount": "2"}],
+        }
+    )
+
+
+def stale_index():
+    index = p4_utils.ServerIndex()
+    index.add(
+        users=["alee"],
+        groups=["c1"],
+        depots=["c1"],
+        protections=["write group c1 * //c1/..."],
+    )
+    return index
+
+
+class RecheckTest(unittest.TestCase):
+    def test_names_created_elsewhere_are_added(self):
+        index = stale_index()
+        with make_server().serving():
+            index.recheck(
+                users=["alee", "bdiaz", "cng"],
+                groups=["c1", "c2", "c3"],
+                depots=["c1", "c2", "c3"],
+            )
+        self.assertEqual(index.users, {"alee", "bdiaz"})
+        self.assertEqual(index.groups, {"c1", "c2"})
+        self.assertEqual(index.depots, {"c1", "c2"})
+
+    def test_only_names_missing_from_the_index_are_queried(self):
+        server = make_server()
+        with server.serving():
+            stale_index().recheck(users=["alee", "cng"], groups=["c1"], depots=["c1"])
+        self.assertEqual(server.ran("users"), [["users", "cng"]])
+        self.assertEqual(server.ran("groups"), [])
+        self.assertEqual(server.ran("depots"), [])
+
+
+class PlanTest(unittest.TestCase):
+    def test_stale_index_does_not_plan_existing_objects(self):
+        shared_data = pipeline.SharedData()
+        shared_data.server_index = stale_index()
+        for user, group in (("alee", "c1"), ("bdiaz", "c2"), ("cng", "c3")):
+            shared_data.roster.append([user, f"{user}@school.edu", group, False])
+        with make_server().serving():
+            pipeline.prepare_data(shared_data)
+        self.assertEqual(
+            [user["User"] for user in shared_data.users_to_create], ["cng"]
+        )
+        self.assertEqual(
+            [group["Group"] for group in shared_data.groups_to_create], ["c3"]
+        )
+        self.assertEqual(shared_data.depots_to_create, ["c3"])
+
+
+class RecordAppliedTest(unittest.TestCase):
+    def test_stages_that_never_ran_add_nothing(self):
+        shared_data = pipeline.SharedData()
+        shared_data.server_index = stale_index()
+        shared_data.permissions_to_create = ["write group c3 * //c3/..."]
+        pipeline.record_applied(
+            shared_data, users_created=[{"User": "cng"}], groups_created=[]
+        )
+        self.assertIn("cng", shared_data.server_index.users)
+        self.assertNotIn(
+            "write group c3 * //c3/...", shared_data.server_index.protections
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+
+from fake_server import FakeServer
+
+import pipeline
+from p4_utils import concurrency, P4Exception
+
+TEMPLATE_STREAMS = [
+    {"Stream": "//tpl/main", "Type": "mainline"},
+    {"Stream": "//tpl/dev", "Type": "development"},
+]
+
+
+class FailOnce:
+    """Responds with records, except for the first call matching a test."""
+
+    def __init__(self, test, error="TCP receive failed", records=()):
+        self.test = test
+        self.error = error
+        self.records = list(records)
+        self.failed = False
+
+    def __call__(self, args):
+        if not self.failed and self.test(args):
+            self.failed = True
+            return P4Exception(self.error)
+        return self.records
+
+
+class RetryTestCase(unittest.TestCase):
+    def setUp(self):
+        # Retry at once rather than after a random backoff.
+        patcher = mock.patch.object(concurrency.random, "uniform", lambda low, high: 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shared_data = pipeline.SharedData()
+        self.shared_data.template_depot = {"name": "tpl", "type": "stream"}
+
+
+class CreateUsersTest(RetryTestCase):
+    def test_a_retry_skips_the_steps_that_went_through(self):
+        self.shared_data.users_to_create = [
+            {"User": "alee", "Email": "alee@school.edu", "FullName": "A Lee"}
+        ]
+        server = FakeServer({"admin": FailOnce(lambda args: True)})
+        with server.serving():
+            created = pipeline.create_users(self.shared_data)
+        self.assertEqual([user["User"] for user in created], ["alee"])
+        self.assertEqual(len(server.ran("user")), 1)
+        # Setting the password again would undo the reset that follows it.
+        self.assertEqual(len(server.ran("passwd")), 1)
+        self.assertEqual(len(server.ran("admin")), 2)
+
+    def test_no_reset_unless_required(self):
+        self.shared_data.require_password_reset = False
+        self.shared_data.users_to_create = [
+            {"User": "alee", "Email": "alee@school.edu", "FullName": "A Lee"}
+        ]
+        server = FakeServer()
+        with server.serving():
+            pipeline.create_users(self.shared_data)
+        self.assertEqual(server.ran("admin"), [])
+
+
+class PopulateDepotsTest(RetryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shared_data.depots_to_create = ["c1"]
+        self.shared_data.stream_template = mock.Mock(streams=TEMPLATE_STREAMS)
+
+    def test_a_retry_only_populates_the_streams_left(self):
+        server = FakeServer(
+            {"populate": FailOnce(lambda args: args[-1] == "//c1/dev/...")}
+        )
+        with server.serving():
+            pipeline.populate_depots(self.shared_data)
+        self.assertEqual(
+            [args[-1] for args in server.ran("populate")],
+            ["//c1/main/...", "//c1/dev/...", "//c1/dev/..."],
+        )
+        self.assertEqual(server.ran("files"), [["files", "-m1", "//c1/dev/..."]])
+
+    def test_a_populate_the_server_finished_is_not_repeated(self):
+        # The reply was lost, but //c1/main was filled.
+        server = FakeServer(
+            {
+                "populate": FailOnce(lambda args: args[-1] == "//c1/main/..."),
+                "files": lambda args: (
+                    [{"depotFile": "//c1/main/a.txt"}]
+                    if args[-1] == "//c1/main/..."
+                    else []
+                ),
+            }
+        )
+        with server.serving():
+            pipeline.populate_depots(self.shared_data)
+        self.assertEqual(
+            [args[-1] for args in server.ran("populate")],
+            ["//c1/main/...", "//c1/dev/..."],
+        )
+
+    def test_first_attempts_do_not_check_for_files(self):
+        server = FakeServer()
+        with server.serving():
+            pipeline.populate_depots(self.shared_data)
+        self.assertEqual(len(server.ran("populate")), 2)
+        self.assertEqual(server.ran("files"), [])
+
+
+class CreatePermissionsTest(RetryTestCase):
+    def test_lines_already_written_are_not_added_again(self):
+        self.shared_data.permissions_to_create = [
+            "write group c1 * //c1/...",
+            "write group c2 * //c2/...",
+        ]
+        server = FakeServer(
+            {"protect": [{"Protections": ["write group c1 * //c1/..."]}]}
+        )
+        with server.serving():
+            pipeline.create_permissions(self.shared_data)
+        written = [
+            spec["Protections"]
+            for args, spec in zip(server.commands, server.inputs)
+            if args == ["protect", "-i"]
+        ]
+        self.assertEqual(
+            written, [["write group c2 * //c2/...", "write group c1 * //c1/..."]]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+import unittest
+
+from fake_server import FakeServer
+
+from P4 import P4
+import p4_utils
+from p4_utils import replay, P4Exception
+
+p4 = p4_utils.p4
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.trace_file = os.path.join(directory.name, "trace.jsonl")
+        # Back to plain connections once the test is done.
+        self.addCleanup(p4.use_transport, P4)
+
+    def record(self, responses, commands):
+        """Record commands (callables) against a FakeServer with responses."""
+        with FakeServer(responses).serving():
+            recorder = replay.start_recording(self.trace_file)
+            try:
+                for command in commands:
+                    command()
+            finally:
+                recorder.close()
+
+    def trace(self):
+        with open(self.trace_file, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+
+class RoundTripTest(ReplayTestCase):
+    def test_replay_answers_like_the_recorded_server(self):
+        recorded = {}
+
+        def failing_groups():
+            with self.assertRaises(P4Exception):
+                p4.run("groups")
+
+        self.record(
+            {
+                "users": [{"User": "alee"}, {"User": "bdiaz"}],
+                "depots": [{"name": "c1_a"}, {"name": "c1_b"}],
+                "groups": P4Exception("You don't have permission for this operation."),
+            },
+            [
+                lambda: recorded.setdefault("users", p4.run("users")),
+                lambda: recorded.setdefault(
+                    "depots", p4_utils.collect_field("name", "depots")
+                ),
+                failing_groups,
+            ],
+        )
+        self.assertEqual(len(self.trace()), 3)
+
+        # No FakeServer from here on: every answer comes from the trace.
+        replayer = replay.start_replay(self.trace_file, speed=0)
+        self.assertEqual(p4.run("users"), recorded["users"])
+        self.assertEqual(p4_utils.collect_field("name", "depots"), {"c1_a", "c1_b"})
+        with self.assertRaises(P4Exception) as raised:
+            p4.run("groups")
+        self.assertIn("don't have permission", str(raised.exception))
+        self.assertEqual(replayer.count, 3)
+        self.assertEqual(replayer.unmatched, [])
+
+    def test_commands_with_the_same_arguments_are_matched_by_input(self):
+        def save_group(name):
+            p4.input = {"Group": name, "Users": [name]}
+            p4.run("group", "-i")
+
+        self.record(
+            {"group": lambda args: [f"Group saved {len(args)}"]},
+            [lambda: save_group("c1_a"), lambda: save_group("c1_b")],
+        )
+        replayer = replay.start_replay(self.trace_file, speed=0)
+        save_group("c1_b")
+        save_group("c1_a")
+        self.assertEqual(replayer.count, 2)
+        self.assertEqual(sum(len(queue) for queue in replayer.entries.values()), 0)
+
+
+class RedactionTest(ReplayTestCase):
+    def test_passwords_never_reach_the_trace(self):
+        def login():
+            p4.input = "hunter2"
+            p4.run("login")
+
+        def passwd():
+            p4.input = "correct horse"
+            p4.run("passwd", "alee")
+
+        def save_group():
+            p4.input = {"Group": "c1_a"}
+            p4.run("group", "-i")
+
+        self.record({}, [login, passwd, save_group])
+        with open(self.trace_file, encoding="utf-8") as f:
+            text = f.read()
+        self.assertNotIn("hunter2", text)
+        self.assertNotIn("correct horse", text)
+        self.assertEqual(
+            [entry["input"] for entry in self.trace()],
+            ["<redacted>", "<redacted>", {"Group": "c1_a"}],
+        )
+
+
+class MissingCommandTest(ReplayTestCase):
+    def test_commands_not_in_the_trace_fail_and_are_reported(self):
+        self.record({"users": [{"User": "alee"}]}, [lambda: p4.run("users")])
+        replayer = replay.start_replay(self.trace_file, speed=0)
+        with self.assertRaisesRegex(P4Exception, "not in trace"):
+            p4.run("depots")
+        # Each recorded answer is only used once.
+        p4.run("users")
+        with self.assertRaisesRegex(P4Exception, "not in trace"):
+            p4.run("users")
+        self.assertEqual(replayer.unmatched, ["depots", "users"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from roster import Roster  # noqa: E402
+
+try:
+    import main
+except ImportError:  # PyQt6 or P4Python is not installed.
+    main = None
+
+
+ROWS = [
+    ["Ann Lee", "alee@school.edu", "team1", True],
+    ["Bo Diaz", "bdiaz@school.edu", "team1", False],
+    ["Ann Lee (2nd)", "alee@school.edu", "team2", False],
+    ["Cy Ng", "cng@other.edu", "team2", True],
+]
+
+
+def make_roster(rows=ROWS):
+    roster = Roster()
+    for row in rows:
+        roster.append(row)
+    return roster
+
+
+class RosterTest(unittest.TestCase):
+    def test_rows_keep_their_values(self):
+        roster = make_roster()
+        self.assertEqual(len(roster), 4)
+        self.assertEqual(roster[1].as_list(), ROWS[1])
+        self.assertEqual(roster[1].user, "bdiaz")
+        self.assertEqual(
+            [row.group for row in roster], ["team1", "team1", "team2", "team2"]
+        )
+
+    def test_users_are_unique_and_keep_their_first_row(self):
+        users = make_roster().users()
+        self.assertEqual(
+            users,
+            [
+                {"User": "alee", "Email": "alee@school.edu", "FullName": "Ann Lee"},
+                {"User": "bdiaz", "Email": "bdiaz@school.edu", "FullName": "Bo Diaz"},
+                {"User": "cng", "Email": "cng@other.edu", "FullName": "Cy Ng"},
+            ],
+        )
+
+    def test_group_members(self):
+        self.assertEqual(
+            make_roster().group_members(),
+            {
+                "team1": {"Users": ["alee", "bdiaz"], "Owners": ["alee"]},
+                "team2": {"Users": ["alee", "cng"], "Owners": ["cng"]},
+            },
+        )
+        self.assertEqual(make_roster().groups(), ["team1", "team2"])
+
+    def test_names_are_shared_between_rows(self):
+        roster = make_roster()
+        self.assertIs(roster[0].user, roster[2].user)
+        self.assertIs(roster[0].group, roster[1].group)
+
+    def test_edits_refresh_the_cached_lists(self):
+        roster = make_roster()
+        self.assertEqual(len(roster.users()), 3)
+        roster.update(1, 1, "ann.other@school.edu")
+        roster.update(3, 2, "team3")
+        self.assertEqual(
+            [user["User"] for user in roster.users()], ["alee", "ann.other", "cng"]
+        )
+        self.assertEqual(roster.groups(), ["team1", "team2", "team3"])
+        roster.append(["Di Fox", "dfox@school.edu", "team3", False])
+        self.assertEqual(roster.group_members()["team3"]["Users"], ["cng", "dfox"])
+
+
+@unittest.skipIf(main is None, "main.py needs PyQt6 and P4Python")
+class ValidateCsvRowTest(unittest.TestCase):
+    def test_valid_row(self):
+        self.assertEqual(
+            main.validate_csv_row(1, [" Ann Lee ", "alee@school.edu", "team1", "yes"]),
+            ["Ann Lee", "alee@school.edu", "team1", True],
+        )
+        self.assertFalse(
+            main.validate_csv_row(1, ["Ann Lee", "alee@school.edu", "team1", "no"])[3]
+        )
+
+    def test_wrong_column_count(self):
+        for row in (
+            ["Ann Lee", "alee@school.edu", "team1"],
+            ["Ann Lee", "alee@school.edu", "team1", "", "extra"],
+        ):
+            with self.assertRaisesRegex(
+                main.CSV_VALIDATION_ERROR, "Expected 4 columns"
+            ):
+                main.validate_csv_row(1, row)
+
+    def test_invalid_fields(self):
+        for row in (
+            ["", "alee@school.edu", "team1", ""],
+            ["Ann Lee", "not-an-email", "team1", ""],
+            ["Ann Lee", "alee@school.edu", "team/1", ""],
+            ["Ann Lee", "alee@school.edu", "123", ""],
+        ):
+            with self.assertRaises(main.CSV_VALIDATION_ERROR):
+                main.validate_csv_row(1, row)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+
+from fake_server import FakeServer
+
+from p4_utils import stream_template
+from p4_utils.stream_template import StreamTemplate, retarget_stream_name
+
+MAIN = {
+    "Stream": "//tpl/main",
+    "Name": "main",
+    "Parent": "none",
+    "Type": "mainline",
+    "Owner": "tpl_admin",
+    "Description": "Mainline of //tpl/main, copied from tpl.",
+    "Options": "allsubmit unlocked notoparent nofromparent mergedown",
+    "Paths": [
+        "share ...",
+        "import art/... //tpl/art/...",
+        "import shared/... //tpl2_tpl/shared/...",
+        'import "with space/..." "//tpl/with space/..."',
+    ],
+    "Ignored": ["-//tpl/main/bin/..."],
+    "Update": "2026/01/01 00:00:00",
+    "Access": "2026/01/01 00:00:00",
+}
+DEV = {
+    "Stream": "//tpl/dev",
+    "Name": "dev",
+    "Parent": "//tpl/main",
+    "Type": "development",
+    "Owner": "tpl_admin",
+    "Description": "Work on //tpl/dev",
+    "Paths": ["share ..."],
+}
+FEATURE = {
+    "Stream": "//tpl/feature",
+    "Name": "feature",
+    "Parent": "//tpl/dev",
+    "Type": "development",
+    "Owner": "tpl_admin",
+    "Description": "",
+    "Paths": ["share ..."],
+}
+
+
+class RetargetStreamNameTest(unittest.TestCase):
+    def test_streams_of_the_template_move_to_the_new_depot(self):
+        self.assertEqual(retarget_stream_name("//tpl/main", "tpl", "c1"), "//c1/main")
+
+    def test_other_depots_are_left_alone(self):
+        self.assertEqual(
+            retarget_stream_name("//tpl2_tpl/main", "tpl", "c1"), "//tpl2_tpl/main"
+        )
+        self.assertEqual(
+            retarget_stream_name("//tpl2/main", "tpl", "c1"), "//tpl2/main"
+        )
+        self.assertEqual(retarget_stream_name("none", "tpl", "c1"), "none")
+
+
+class StreamTemplateTest(unittest.TestCase):
+    def test_path_fields_are_retargeted(self):
+        (main,) = StreamTemplate("tpl", [MAIN]).for_depot("c1")
+        self.assertEqual(main["Stream"], "//c1/main")
+        self.assertEqual(main["Parent"], "none")
+        self.assertEqual(
+            main["Paths"],
+            [
+                "share ...",
+                "import art/... //c1/art/...",
+                "import shared/... //tpl2_tpl/shared/...",
+                'import "with space/..." "//c1/with space/..."',
+            ],
+        )
+        self.assertEqual(main["Ignored"], ["-//c1/main/bin/..."])
+
+    def test_other_fields_are_copied_unchanged(self):
+        (main,) = StreamTemplate("tpl", [MAIN]).for_depot("c1")
+        for key in ["Name", "Type", "Owner", "Description", "Options"]:
+            self.assertEqual(main[key], MAIN[key])
+        self.assertNotIn("Update", main)
+        self.assertNotIn("Access", main)
+
+    def test_template_names_are_matched_literally(self):
+        spec = {"Stream": "//a.b/main", "Paths": ["import x/... //axb/x/..."]}
+        (main,) = StreamTemplate("a.b", [spec]).for_depot("c1")
+        self.assertEqual(main["Stream"], "//c1/main")
+        self.assertEqual(main["Paths"], ["import x/... //axb/x/..."])
+
+    def test_every_depot_gets_its_own_copy(self):
+        template = StreamTemplate("tpl", [MAIN])
+        (c1,) = template.for_depot("c1")
+        c1["Paths"].append("isolate bin/...")
+        (c2,) = template.for_depot("c2")
+        self.assertEqual(c2["Paths"][0], "share ...")
+        self.assertEqual(len(c2["Paths"]), len(MAIN["Paths"]))
+        self.assertEqual(c2["Stream"], "//c2/main")
+
+    def test_parents_come_first(self):
+        template = StreamTemplate("tpl", [FEATURE, DEV, MAIN])
+        self.assertEqual(
+            [spec["Stream"] for spec in template.for_depot("c1")],
+            ["//c1/main", "//c1/dev", "//c1/feature"],
+        )
+
+    def test_parents_first_keeps_siblings_after_their_parent(self):
+        hotfix = {"Stream": "//tpl/hotfix", "Parent": "//tpl/main"}
+        ordered = stream_template._parents_first([FEATURE, hotfix, DEV, MAIN])
+        names = [spec["Stream"] for spec in ordered]
+        self.assertEqual(names[0], "//tpl/main")
+        self.assertLess(names.index("//tpl/dev"), names.index("//tpl/feature"))
+        self.assertEqual(
+            set(names), {"//tpl/main", "//tpl/dev", "//tpl/feature", "//tpl/hotfix"}
+        )
+
+
+class GetStreamTemplateTest(unittest.TestCase):
+    def test_template_specs_are_fetched_once(self):
+        specs = {spec["Stream"]: spec for spec in [MAIN, DEV]}
+        server = FakeServer(
+            {
+                "streams": [{"Stream": "//tpl/dev"}, {"Stream": "//tpl/main"}],
+                "stream": lambda args: [specs[args[-1]]],
+            }
+        )
+        with server.serving():
+            template = stream_template.get_stream_template("tpl")
+        self.assertEqual(len(server.ran("streams")), 1)
+        self.assertEqual(len(server.ran("stream")), 2)
+        self.assertEqual(
+            [spec["Stream"] for spec in template.for_depot("c1")],
+            ["//c1/main", "//c1/dev"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
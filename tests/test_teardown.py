@@ -0,0 +1,187 @@
+import unittest
+
+from fake_server import FakeServer
+
+import p4_utils
+from p4_utils import teardown
+
+DEPOTS = [
+    {"name": "c1_a", "type": "stream"},
+    {"name": "c1_b", "type": "local"},
+    {"name": "c1_template", "type": "stream"},
+    {"name": "c1_spec", "type": "spec"},
+    {"name": "c10", "type": "stream"},
+    {"name": "depot", "type": "local"},
+]
+MEMBERSHIPS = [
+    ("c1_a", "alee"),
+    ("c1_a", "bdiaz"),
+    ("c1_a", "admin"),
+    ("c1_b", "cng"),
+    ("c10", "dfox"),
+    ("staff", "bdiaz"),
+    ("c1_template", "tfox"),
+]
+STREAMS = [
+    {"Stream": "//c1_a/feature", "Parent": "//c1_a/dev", "Type": "development"},
+    {"Stream": "//c1_a/main", "Parent": "none", "Type": "mainline"},
+    {"Stream": "//c1_a/dev", "Parent": "//c1_a/main", "Type": "development"},
+    {"Stream": "//c10/main", "Parent": "none", "Type": "mainline"},
+]
+USERS = ["admin", "alee", "bdiaz", "cng", "dfox", "tfox"]
+PROTECTIONS = [
+    "super user admin * //...",
+    "write group c1_a * //c1_a/...",
+    "write group staff * //depot/...",
+    "read user bdiaz * //c1_b/...",
+    "write group c10 * //c10/...",
+    "read group c1_template * //c1_template/...",
+    "write user cng * //depot/cng/...",
+]
+
+
+def streams_response(args):
+    paths = [arg[: -len("...")] for arg in args if arg.startswith("//")]
+    return [
+        stream
+        for stream in STREAMS
+        if any(stream["Stream"].startswith(path) for path in paths)
+    ]
+
+
+def make_server():
+    return FakeServer(
+        {
+            "depots": DEPOTS,
+            "groups": [
+                {"group": group, "user": user, "isUser": "1"}
+                for group, user in MEMBERSHIPS
+            ],
+            "streams": streams_response,
+            "users": lambda args: [{"User": user} for user in args if user in USERS],
+            "protect": [{"Protections": list(PROTECTIONS)}],
+        }
+    )
+
+
+class PlanTeardownTest(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server()
+        serving = self.server.serving()
+        serving.__enter__()
+        self.addCleanup(serving.__exit__, None, None, None)
+        user = p4_utils.p4.user
+        p4_utils.p4.user = "admin"
+        self.addCleanup(setattr, p4_utils.p4, "user", user)
+
+    def test_pattern_selects_matching_depots_and_groups(self):
+        plan = teardown.plan_teardown(depot_pattern="c1_*")
+        # c10 does not match "c1_*"; spec depots and templates are never selected.
+        self.assertEqual(plan["depots"], ["c1_a", "c1_b"])
+        self.assertEqual(plan["groups"], ["c1_a", "c1_b"])
+        self.assertEqual(plan["users"], [])
+        self.assertEqual(
+            plan["protections"],
+            ["write group c1_a * //c1_a/...", "read user bdiaz * //c1_b/..."],
+        )
+
+    def test_child_streams_come_before_their_parents(self):
+        plan = teardown.plan_teardown(depot_pattern="c1_*")
+        self.assertEqual(
+            plan["streams"], {"c1_a": ["//c1_a/feature", "//c1_a/dev", "//c1_a/main"]}
+        )
+
+    def test_template_depots_are_never_selected(self):
+        plan = teardown.plan_teardown(depot_pattern="*template*", remove_users=True)
+        self.assertEqual(plan["depots"], [])
+        self.assertEqual(plan["streams"], {})
+        self.assertEqual(plan["groups"], [])
+        self.assertEqual(plan["protections"], [])
+        self.assertEqual(plan["users"], [])
+
+    def test_named_groups_select_their_depots(self):
+        plan = teardown.plan_teardown(group_names=["c10", "nope"])
+        self.assertEqual(plan["depots"], ["c10"])
+        self.assertEqual(plan["groups"], ["c10"])
+        self.assertEqual(plan["streams"], {"c10": ["//c10/main"]})
+        self.assertEqual(plan["protections"], ["write group c10 * //c10/..."])
+
+    def test_pattern_users_are_only_in_removed_groups(self):
+        plan = teardown.plan_teardown(depot_pattern="c1_*", remove_users=True)
+        # bdiaz is still in staff; admin runs the teardown.
+        self.assertEqual(plan["users"], ["alee", "cng"])
+
+    def test_protections_of_removed_users_are_removed(self):
+        plan = teardown.plan_teardown(depot_pattern="c1_*", remove_users=True)
+        self.assertIn("write user cng * //depot/cng/...", plan["protections"])
+        # Without --remove-users, cng and their protections stay.
+        plan = teardown.plan_teardown(depot_pattern="c1_*")
+        self.assertNotIn("write user cng * //depot/cng/...", plan["protections"])
+
+    def test_named_users_that_exist_are_selected(self):
+        plan = teardown.plan_teardown(
+            group_names=["c1_a"], user_names=["alee", "gone"], remove_users=True
+        )
+        self.assertEqual(plan["users"], ["alee"])
+
+    def test_named_users_still_in_other_groups_are_kept(self):
+        plan = teardown.plan_teardown(
+            group_names=["c1_a"], user_names=["alee", "bdiaz"], remove_users=True
+        )
+        # bdiaz is also in staff, which is not being removed.
+        self.assertEqual(plan["users"], ["alee"])
+
+    def test_the_current_user_is_never_selected(self):
+        plan = teardown.plan_teardown(
+            group_names=["c1_a"], user_names=["admin", "alee"], remove_users=True
+        )
+        self.assertNotIn("admin", plan["users"])
+
+
+class RunTeardownTest(unittest.TestCase):
+    def test_protections_go_first_and_streams_before_their_depot(self):
+        server = make_server()
+        with server.serving():
+            plan = teardown.plan_teardown(depot_pattern="c1_*")
+            server.commands.clear()
+            server.inputs.clear()
+            failures = teardown.run_teardown(plan)
+        self.assertEqual(failures, {})
+        self.assertEqual(server.commands[:2], [["protect", "-o"], ["protect", "-i"]])
+        written = server.inputs[1]["Protections"]
+        self.assertEqual(
+            written,
+            [line for line in PROTECTIONS if line not in plan["protections"]],
+        )
+        deleted = [args[-1] for args in server.commands[2:]]
+        self.assertLess(deleted.index("//c1_a/feature"), deleted.index("//c1_a/dev"))
+        self.assertLess(deleted.index("//c1_a/main"), deleted.index("//c1_a/..."))
+        self.assertLess(deleted.index("//c1_a/..."), deleted.index("c1_a"))
+        self.assertEqual(
+            sorted(server.ran("group")),
+            [["group", "-dF", "c1_a"], ["group", "-dF", "c1_b"]],
+        )
+
+    def test_failures_are_reported_per_name(self):
+        def delete_group(args):
+            if args[-1] == "c1_b":
+                return p4_utils.P4Exception("Group c1_b is locked.")
+            return []
+
+        server = make_server()
+        server.responses["group"] = delete_group
+        plan = {
+            "protections": [],
+            "streams": {},
+            "depots": [],
+            "groups": ["c1_a", "c1_b"],
+            "users": [],
+        }
+        with server.serving():
+            failures = teardown.run_teardown(plan)
+        self.assertEqual(list(failures), ["groups"])
+        self.assertEqual(list(failures["groups"]), ["c1_b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+
+from fake_server import FakeServer
+
+from p4_utils import verification, P4Exception
+
+TEMPLATE_STREAMS = [
+    {"Stream": "//tpl/main", "Type": "mainline"},
+    {"Stream": "//tpl/dev", "Type": "development"},
+    {"Stream": "//tpl/virtual", "Type": "virtual"},
+]
+
+
+def make_server(streams, sizes):
+    """A server with the groups, depots and protections of c1 and c2 in place.
+
+    streams: the stream names that exist; sizes: {stream: (count, size)}.
+    """
+
+    def list_streams(args):
+        paths = [arg[: -len("...")] for arg in args if arg.startswith("//")]
+        return [
+            {"Stream": name, "Type": "mainline"}
+            for name in streams
+            if any(name.startswith(path) for path in paths)
+        ] + [
+            stream
+            for stream in TEMPLATE_STREAMS
+            if any(stream["Stream"].startswith(path) for path in paths)
+        ]
+
+    def list_sizes(args):
+        return [
+            {
+                "path": path,
+                "fileCount": str(sizes[path[: -len("/...#head")]][0]),
+                "fileSize": str(sizes[path[: -len("/...#head")]][1]),
+            }
+            for path in args[2:]
+            if path[: -len("/...#head")] in sizes
+        ]
+
+    return FakeServer(
+        {
+            "users": lambda args: [{"User": user} for user in args[1:]],
+            "groups": [
+                {"group": group, "user": "alee", "isUser": "1", "isOwner": "0"}
+                for group in ("c1", "c2")
+            ],
+            "protect": [
+                {
+                    "Protections": [
+                        "write group c1 * //c1/...",
+                        "write group c2 * //c2/...",
+                    ]
+                }
+            ],
+            "depots": [{"name": "c1"}, {"name": "c2"}, {"name": "tpl"}],
+            "streams": list_streams,
+            "sizes": list_sizes,
+        }
+    )
+
+
+def verify(server, populated_depots=None):
+    with server.serving():
+        return verification.verify_run(
+            users=["alee"],
+            group_members={
+                group: {"Users": ["alee"], "Owners": []} for group in ("c1", "c2")
+            },
+            depots=["c1", "c2"],
+            template_depot_name="tpl",
+            populated_depots=populated_depots,
+        )
+
+
+SIZES = {"//tpl/main": (2, 10), "//tpl/dev": (1, 5)}
+ALL_STREAMS = ["//c1/main", "//c1/dev", "//c1/virtual", "//c2/main", "//c2/dev"]
+
+
+class StreamsTest(unittest.TestCase):
+    def test_streams_are_checked_without_populating(self):
+        server = make_server(ALL_STREAMS, SIZES)
+        report = verify(server)
+        self.assertEqual(report["streams"]["expected"], 6)
+        self.assertEqual(report["streams"]["missing"], ["//c2/virtual"])
+        self.assertFalse(report["ok"])
+        # Sizes are only compared for populated depots.
+        self.assertEqual(server.ran("sizes"), [])
+        self.assertEqual(report["files"]["checked"], 0)
+
+    def test_only_populated_depots_are_sized(self):
+        sizes = dict(SIZES, **{"//c2/main": (2, 10), "//c2/dev": (1, 5)})
+        server = make_server(ALL_STREAMS + ["//c2/virtual"], sizes)
+        report = verify(server, populated_depots=["c2"])
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(report["files"]["checked"], 2)
+
+    def test_streams_that_cannot_be_sized_are_mismatched(self):
+        sizes = dict(SIZES, **{"//c2/main": (2, 10), "//c2/dev": (1, 5)})
+        server = make_server(ALL_STREAMS + ["//c2/virtual"], sizes)
+        list_sizes = server.responses["sizes"]
+        server.responses["sizes"] = lambda args: (
+            P4Exception("Unable to read //c2/dev.")
+            if "//c2/dev/...#head" in args
+            else list_sizes(args)
+        )
+        report = verify(server, populated_depots=["c2"])
+        self.assertFalse(report["ok"])
+        self.assertEqual(
+            report["files"]["mismatched"],
+            {"//c2/dev": {"expected": {"fileCount": 1, "fileSize": 5}, "actual": None}},
+        )
+
+
+class SharedListingsTest(unittest.TestCase):
+    def test_server_wide_listings_are_fetched_once(self):
+        sizes = dict(SIZES, **{"//c1/main": (2, 10), "//c1/dev": (1, 5)})
+        server = make_server(ALL_STREAMS + ["//c2/virtual"], sizes)
+        with server.serving():
+            listings = verification.fetch_listings("tpl")
+            reports = [
+                verification.verify_run(
+                    users=["alee"],
+                    group_members={depot: {"Users": ["alee"], "Owners": []}},
+                    depots=[depot],
+                    template_depot_name="tpl",
+                    populated_depots=[depot] if depot == "c1" else None,
+                    listings=listings,
+                )
+                for depot in ("c1", "c2")
+            ]
+        self.assertTrue(all(report["ok"] for report in reports), reports)
+        for command in ("groups", "protect", "depots"):
+            self.assertEqual(len(server.ran(command)), 1, command)
+        # The template's streams once, then each depot's.
+        self.assertEqual(len(server.ran("streams")), 3)
+        self.assertEqual(reports[1]["queries"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()